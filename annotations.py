@@ -0,0 +1,53 @@
+"""Représentation légère des `text_annotations` Google Vision.
+
+Les fonctions d_extraction n_utilisent que `annotation.description` et
+`annotation.bounding_poly.vertices[i].x / .y` : ces petites classes exposent exactement
+cette forme, ce qui permet de sérialiser une réponse Vision (cache, fixtures) et de la
+rejouer sans le client Vision. `confiance` (0-100) n_est renseignée que par Tesseract.
+"""
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class Vertex:
+    x: int = 0
+    y: int = 0
+
+
+@dataclass(slots=True)
+class BoundingPoly:
+    vertices: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class TextAnnotation:
+    description: str = ""
+    bounding_poly: BoundingPoly = field(default_factory=BoundingPoly)
+    confiance: float | None = None
+
+
+def annotations_vers_dicts(text_annotations) -> list:
+    """Vision `text_annotations` (ou TextAnnotation) -> liste de dicts JSON-sérialisables."""
+    resultat = []
+    for annotation in text_annotations:
+        vertices = getattr(getattr(annotation, "bounding_poly", None), "vertices", None) or []
+        donnees = {
+            "description": annotation.description,
+            "vertices": [[v.x, v.y] for v in vertices],
+        }
+        confiance = getattr(annotation, "confiance", None)
+        if confiance is not None:
+            donnees["confiance"] = confiance
+        resultat.append(donnees)
+    return resultat
+
+
+def dicts_vers_annotations(donnees: list) -> list:
+    return [
+        TextAnnotation(
+            description=d.get("description", ""),
+            bounding_poly=BoundingPoly(vertices=[Vertex(x, y) for x, y in d.get("vertices", [])]),
+            confiance=d.get("confiance"),
+        )
+        for d in donnees
+    ]
@@ -0,0 +1,521 @@
+"""Rattrapage en masse : traite un dossier de captures ou un export de chat Telegram.
+
+Sans bot ni webhook. Les images sont lues, hachées et prétraitées dans un pool de
+process. L_OCR Vision part en appels batch_annotate_images (un paquet de `--lot-ocr`
+images par appel), avec au plus `--concurrence` appels en vol. L_extraction
+(identification du compte, followers) retourne aussi dans le pool de process.
+
+Avancement dans un checkpoint SQLite (une ligne par image) : une image déjà traitée
+n_est pas refaite, les lignes prêtes mais pas encore envoyées le sont à la reprise.
+Les images en erreur sont retentées au lancement suivant. Les lignes partent dans
+Google Sheets par gros lots `append_rows` (`--lot-sheet`), puis dans l_historique local
+si `--historique` est donné.
+
+--dry-run : hors ligne. L_OCR est remplacé par les fixtures enregistrées (`<sha256>.json`,
+voir ocr_fixtures.py) ; rien n_est écrit (ni Sheets, ni historique, ni checkpoint).
+
+Usage :
+    python backfill.py captures/
+    python backfill.py export_telegram/ --historique data/historique.sqlite3
+    python backfill.py captures/ --dry-run --fixtures data/fixtures --json resultats.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from annotations import annotations_vers_dicts, dicts_vers_annotations
+from demarrage import ErreurConfiguration
+from extraction import corriger_username, identifier_reseau_et_username_par_ocr
+from handle_matcher import HandleMatcher
+from ocr_cache import hash_contenu
+from ocr_fixtures import charger_fixture
+from pretraitement import pretraiter_image, reprojeter_annotations
+
+logger = logging.getLogger(__name__)
+
+FORMAT_LOG = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+FORMAT_HORODATAGE = "%Y-%m-%d %H:%M:%S"
+EXTENSIONS_IMAGES = {".jpg", ".jpeg", ".png", ".webp"}
+MAX_IMAGES_PAR_APPEL_VISION = 16  # limite de batch_annotate_images
+MAX_TENTATIVES_SHEETS = 5
+
+# Statuts du checkpoint. "erreur" et "simule" sont retentés au lancement suivant, les autres sont définitifs.
+EN_ATTENTE = "en_attente"  # ligne prête, pas encore envoyée dans Sheets
+ECRIT = "ecrit"
+SIMULE = "simule"  # --dry-run : ligne qui aurait été envoyée, rien n_a été écrit
+ERREUR = "erreur"
+
+
+# --- Sources ----------------------------------------------------------------------
+
+def lister_dossier(dossier: str) -> list:
+    """Images du dossier (récursif) ; horodatage = date de modification du fichier."""
+    elements = []
+    for racine, sous_dossiers, fichiers in os.walk(dossier):
+        sous_dossiers[:] = sorted(d for d in sous_dossiers if not d.startswith("."))
+        for nom in sorted(fichiers):
+            if os.path.splitext(nom)[1].lower() not in EXTENSIONS_IMAGES:
+                continue
+            chemin = os.path.join(racine, nom)
+            elements.append({
+                "chemin": chemin,
+                "horodatage": datetime.datetime.fromtimestamp(os.path.getmtime(chemin)).strftime(FORMAT_HORODATAGE),
+                "posteur": "",
+            })
+    return elements
+
+
+def lister_export_telegram(chemin_json: str) -> list:
+    """Photos d_un export Telegram Desktop (result.json) : date et auteur viennent du message."""
+    with open(chemin_json, "r", encoding="utf-8") as f:
+        export = json.load(f)
+    dossier = os.path.dirname(chemin_json)
+    elements = []
+    for message in export.get("messages", []):
+        if message.get("type") != "message":
+            continue
+        fichier = message.get("photo")
+        # Images envoyées "en tant que fichier" (non compressées)
+        if not fichier and str(message.get("mime_type", "")).startswith("image/"):
+            fichier = message.get("file")
+        if not fichier:
+            continue
+        chemin = os.path.join(dossier, fichier)
+        if not os.path.isfile(chemin):
+            # "(File not included. Change data exporting settings to download.)"
+            logger.warning(f"Message {message.get('id')}: fichier absent de l_export ({fichier}), ignoré.")
+            continue
+        try:
+            horodatage = datetime.datetime.fromisoformat(message["date"]).strftime(FORMAT_HORODATAGE)
+        except (KeyError, ValueError):
+            horodatage = datetime.datetime.fromtimestamp(os.path.getmtime(chemin)).strftime(FORMAT_HORODATAGE)
+        elements.append({"chemin": chemin, "horodatage": horodatage, "posteur": message.get("from") or ""})
+    return elements
+
+
+def lister_source(source: str) -> list:
+    if os.path.isdir(source) and os.path.isfile(os.path.join(source, "result.json")):
+        source = os.path.join(source, "result.json")
+    if os.path.isfile(source):
+        elements = lister_export_telegram(source)
+    else:
+        elements = lister_dossier(source)
+    for element in elements:
+        element["cle"] = os.path.abspath(element["chemin"])
+    return elements
+
+
+# --- Checkpoint ---------------------------------------------------------------------
+
+class Checkpoint:
+    """Avancement du rattrapage : statut de chaque image (clé = chemin absolu) et lignes à envoyer."""
+
+    def __init__(self, chemin: str):
+        dossier = os.path.dirname(chemin)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        self._conn = sqlite3.connect(chemin, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " cle TEXT PRIMARY KEY,"
+            " sha256 TEXT,"
+            " statut TEXT NOT NULL,"
+            " ligne TEXT,"
+            " detail TEXT,"
+            " maj REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256);"
+            "CREATE INDEX IF NOT EXISTS idx_images_statut ON images (statut);"
+        )
+        self._lock = threading.Lock()
+
+    def _transaction(self, fonction):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultat = fonction()
+                self._conn.execute("COMMIT")
+                return resultat
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def cles_traitees(self) -> set:
+        with self._lock:
+            return {cle for (cle,) in self._conn.execute("SELECT cle FROM images WHERE statut NOT IN (?, ?)", (ERREUR, SIMULE))}
+
+    def consigner(self, resultats: list) -> list:
+        """Enregistre les résultats d_un paquet ; retourne les statuts retenus.
+
+        Une image identique (même sha256) à une image qui a déjà produit une ligne est
+        marquée "doublon" : la même capture postée deux fois ne compte qu_une fois.
+        """
+        def ecrire():
+            statuts = []
+            maintenant = time.time()
+            for r in resultats:
+                statut, ligne = r["statut"], r.get("ligne")
+                if ligne is not None and self._conn.execute(
+                    "SELECT 1 FROM images WHERE sha256 = ? AND cle != ? AND ligne IS NOT NULL", (r["sha256"], r["cle"]),
+                ).fetchone():
+                    statut, ligne = "doublon", None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO images (cle, sha256, statut, ligne, detail, maj) VALUES (?, ?, ?, ?, ?, ?)",
+                    (r["cle"], r.get("sha256"), statut, json.dumps(ligne, ensure_ascii=False) if ligne else None,
+                     r.get("detail"), maintenant),
+                )
+                statuts.append(statut)
+            return statuts
+
+        return self._transaction(ecrire)
+
+    def lignes_en_attente(self, limite: int) -> list:
+        with self._lock:
+            lignes = self._conn.execute(
+                "SELECT cle, ligne FROM images WHERE statut = ? ORDER BY maj LIMIT ?", (EN_ATTENTE, limite),
+            ).fetchall()
+        return [(cle, json.loads(ligne)) for cle, ligne in lignes]
+
+    def marquer_ecrites(self, cles: list, statut: str = ECRIT):
+        def marquer():
+            self._conn.executemany(
+                "UPDATE images SET statut = ?, maj = ? WHERE cle = ?", [(statut, time.time(), cle) for cle in cles],
+            )
+
+        self._transaction(marquer)
+
+    def compter(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT statut, COUNT(*) FROM images GROUP BY statut").fetchall())
+
+    def fermer(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Travail dans les process du pool -------------------------------------------------
+
+_matcher = None
+
+
+def _initialiser_process(chemin_handles: str, niveau_log: str):
+    global _matcher
+    logging.basicConfig(format=FORMAT_LOG, level=niveau_log)
+    _matcher = HandleMatcher(chemin_handles)
+
+
+def preparer_image(chemin: str, options_pretraitement: dict | None, dossier_fixtures: str | None) -> dict:
+    """Lecture, sha256 et prétraitement ; en dry-run, lecture de la fixture à la place."""
+    with open(chemin, "rb") as f:
+        contenu = f.read()
+    sha256 = hash_contenu(contenu)
+    if dossier_fixtures is not None:
+        chemin_fixture = os.path.join(dossier_fixtures, f"{sha256}.json")
+        if not os.path.exists(chemin_fixture):
+            return {"sha256": sha256, "annotations": None}
+        # Les fixtures sont enregistrées après reprojection : échelle 1
+        return {"sha256": sha256, "annotations": charger_fixture(chemin_fixture)["text_annotations"], "echelle": 1.0}
+    try:
+        contenu_ocr, echelle = pretraiter_image(contenu, **options_pretraitement)
+    except Exception as e:
+        logger.warning(f"{chemin}: prétraitement impossible ({e}), image envoyée telle quelle.")
+        contenu_ocr, echelle = contenu, 1.0
+    return {"sha256": sha256, "contenu_ocr": contenu_ocr, "echelle": echelle}
+
+
+def analyser_annotations(annotations: list, echelle: float) -> tuple:
+    """(réseau, username corrigé, followers) à partir des annotations sérialisées."""
+    texts = dicts_vers_annotations(annotations)
+    if echelle != 1.0:
+        texts = reprojeter_annotations(texts, echelle)
+    reseau, username, followers = identifier_reseau_et_username_par_ocr(texts, _matcher)
+    if username:
+        username = corriger_username(username, reseau.lower() if reseau else "inconnu")
+    return reseau, username, followers
+
+
+# --- Orchestration --------------------------------------------------------------------
+
+def decouper(elements: list, taille: int):
+    for i in range(0, len(elements), taille):
+        yield elements[i:i + taille]
+
+
+class Rattrapage:
+    def __init__(self, args):
+        self.args = args
+        self.dry_run = args.dry_run
+        self.checkpoint = Checkpoint(":memory:" if args.dry_run else args.checkpoint)
+        self.options_pretraitement = None if args.dry_run else {
+            "max_dimension": args.max_dimension,
+            "niveaux_de_gris": not args.couleur,
+            "qualite_jpeg": args.qualite_jpeg,
+        }
+        # "spawn" comme ailleurs : pas de fork d_un process qui a déjà des threads gRPC
+        self.pool = ProcessPoolExecutor(
+            max_workers=args.processus,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialiser_process,
+            initargs=(args.handles, args.log_level.upper()),
+        )
+        self.appels_ocr = asyncio.Semaphore(args.concurrence)
+        self.vision_client = None
+        self.sheet = None
+        self.historique = None
+        self.rapport = {}  # cle -> résultat, pour les images traitées par ce lancement
+        self.lignes_simulees = []
+
+    def ouvrir_clients(self):
+        if self.dry_run:
+            return
+        from clients_google import creer_client_vision, ouvrir_feuille
+        self.vision_client = creer_client_vision()
+        self.sheet = ouvrir_feuille(self.args.spreadsheet_id)
+        if self.args.historique:
+            from historique import HistoriqueFollowers
+            self.historique = HistoriqueFollowers(self.args.historique)
+
+    async def detecter_textes(self, contenus: list) -> list:
+        """Un appel batch_annotate_images ; des dicts d_annotations par image (exception si erreur Vision)."""
+        from google.cloud import vision
+        requetes = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=contenu),
+                features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+            )
+            for contenu in contenus
+        ]
+
+        def appeler():
+            reponse = self.vision_client.batch_annotate_images(requests=requetes, timeout=self.args.timeout_ocr)
+            # Conversion dans le thread : les dicts se transmettent au pool de process
+            return [
+                RuntimeError(f"Erreur de l_API Vision: {r.error.message}") if r.error.message
+                else annotations_vers_dicts(r.text_annotations)
+                for r in reponse.responses
+            ]
+
+        async with self.appels_ocr:
+            return await asyncio.to_thread(appeler)
+
+    async def traiter_paquet(self, paquet: list) -> list:
+        loop = asyncio.get_running_loop()
+        preparations = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.pool, preparer_image, el["chemin"], self.options_pretraitement,
+                    self.args.fixtures if self.dry_run else None,
+                )
+                for el in paquet
+            ),
+            return_exceptions=True,
+        )
+        resultats = []
+        a_analyser = []
+        for el, prep in zip(paquet, preparations):
+            resultat = {"cle": el["cle"], "fichier": el["chemin"]}
+            resultats.append(resultat)
+            if isinstance(prep, Exception):
+                resultat.update(statut=ERREUR, detail=f"lecture/prétraitement: {prep}")
+                continue
+            resultat["sha256"] = prep["sha256"]
+            a_analyser.append((el, resultat, prep))
+
+        if not self.dry_run and a_analyser:
+            try:
+                annotations = await self.detecter_textes([prep["contenu_ocr"] for _, _, prep in a_analyser])
+            except Exception as e:
+                logger.error(f"Appel Vision en échec pour {len(a_analyser)} image(s): {e}")
+                annotations = [e] * len(a_analyser)
+            for (_, _, prep), annotation in zip(a_analyser, annotations):
+                prep["annotations"] = annotation
+
+        analyses = []
+        for el, resultat, prep in a_analyser:
+            annotations = prep["annotations"]
+            if annotations is None:
+                resultat.update(statut=ERREUR, detail="pas de fixture pour cette image")
+            elif isinstance(annotations, Exception):
+                resultat.update(statut=ERREUR, detail=str(annotations))
+            elif not annotations:
+                resultat.update(statut="sans_texte")
+            else:
+                analyses.append((el, resultat, loop.run_in_executor(
+                    self.pool, analyser_annotations, annotations, prep["echelle"],
+                )))
+        for el, resultat, analyse in analyses:
+            try:
+                reseau, username, followers = await analyse
+            except Exception as e:
+                resultat.update(statut=ERREUR, detail=f"extraction: {e}")
+                continue
+            resultat["obtenu"] = {"reseau": reseau, "username": username, "followers": followers}
+            if not username:
+                resultat.update(statut="compte_inconnu")
+            elif not followers:
+                resultat.update(statut="sans_followers")
+            else:
+                resultat.update(statut=EN_ATTENTE, ligne=[
+                    el["horodatage"], username, followers, reseau, el["posteur"], f"backfill:{resultat['sha256']}",
+                ])
+        return resultats
+
+    async def consigner(self, resultats: list):
+        statuts = await asyncio.to_thread(self.checkpoint.consigner, resultats)
+        for resultat, statut in zip(resultats, statuts):
+            resultat["statut"] = statut
+            if statut == "doublon":
+                resultat.pop("ligne", None)
+            elif statut == ERREUR:
+                logger.warning(f"{resultat['fichier']}: {resultat.get('detail')}")
+            self.rapport[resultat["cle"]] = resultat
+        await self.vider(force=False)
+
+    async def envoyer_sheet(self, lignes: list):
+        from sheets_writer import est_erreur_transitoire
+        delai = 1.0
+        for tentative in range(1, MAX_TENTATIVES_SHEETS + 1):
+            try:
+                await asyncio.to_thread(self.sheet.append_rows, lignes)
+                return
+            except Exception as e:
+                if tentative == MAX_TENTATIVES_SHEETS or not est_erreur_transitoire(e):
+                    raise
+                attente = delai * (0.5 + random.random() / 2)
+                logger.warning(f"append_rows en échec (tentative {tentative}): {e}. Nouvel essai dans {attente:.1f}s.")
+                await asyncio.sleep(attente)
+                delai *= 2
+
+    async def vider(self, force: bool):
+        """Envoie les lignes en attente par lots de `--lot-sheet` (le reste seulement si `force`)."""
+        while True:
+            en_attente = await asyncio.to_thread(self.checkpoint.lignes_en_attente, self.args.lot_sheet)
+            if not en_attente or (len(en_attente) < self.args.lot_sheet and not force):
+                return
+            cles = [cle for cle, _ in en_attente]
+            lignes = sorted((ligne for _, ligne in en_attente), key=lambda ligne: ligne[0])
+            if self.dry_run:
+                self.lignes_simulees.extend(lignes)
+            else:
+                await self.envoyer_sheet(lignes)
+                logger.info(f"{len(lignes)} ligne(s) ajoutée(s) dans Google Sheets.")
+                if self.historique is not None:
+                    alertes = await asyncio.to_thread(self.historique.enregistrer, lignes)
+                    for ligne, alerte in zip(lignes, alertes):
+                        if alerte:
+                            logger.warning(f"Relevé suspect: {ligne[1]} ({ligne[3]}) - {alerte}")
+            # En --dry-run, les lignes sortent de la file sans être comptées comme écrites
+            statut = SIMULE if self.dry_run else ECRIT
+            await asyncio.to_thread(self.checkpoint.marquer_ecrites, cles, statut)
+            for cle in cles:
+                if cle in self.rapport:
+                    self.rapport[cle]["statut"] = statut
+
+    async def executer(self, elements: list):
+        # Reprise : d_abord les lignes prêtes lors du lancement précédent
+        await self.vider(force=True)
+        deja = await asyncio.to_thread(self.checkpoint.cles_traitees)
+        a_faire = [el for el in elements if el["cle"] not in deja]
+        logger.info(f"{len(elements)} image(s) trouvée(s), {len(elements) - len(a_faire)} déjà traitée(s), {len(a_faire)} à traiter.")
+
+        debut = time.perf_counter()
+        en_cours = set()
+        faits = 0
+        # Au plus `concurrence` paquets en vol : borne les appels Vision et la mémoire
+        for paquet in decouper(a_faire, self.args.lot_ocr):
+            if len(en_cours) >= self.args.concurrence:
+                termines, en_cours = await asyncio.wait(en_cours, return_when=asyncio.FIRST_COMPLETED)
+                for tache in termines:
+                    faits += len(tache.result())
+                    await self.consigner(tache.result())
+                logger.info(f"Avancement: {faits}/{len(a_faire)} image(s) ({faits / (time.perf_counter() - debut):.1f} images/s).")
+            en_cours.add(asyncio.create_task(self.traiter_paquet(paquet)))
+        for tache in asyncio.as_completed(en_cours):
+            await self.consigner(await tache)
+        await self.vider(force=True)
+
+    def fermer(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        if self.historique is not None:
+            self.historique.fermer()
+        self.checkpoint.fermer()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Rattrapage en masse d_un dossier de captures ou d_un export Telegram.")
+    parser.add_argument("source", help="Dossier d_images, ou export Telegram Desktop (dossier ou result.json)")
+    parser.add_argument("--checkpoint", default="data/backfill.sqlite3", help="Base SQLite d_avancement (reprise)")
+    parser.add_argument("--handles", default="known_handles.json", help="Fichier known_handles.json")
+    parser.add_argument("--spreadsheet-id", help="Feuille cible (défaut : SPREADSHEET_ID)")
+    parser.add_argument("--historique", help="Enregistre aussi les lignes dans cet historique local (historique.py)")
+    parser.add_argument("--processus", type=int, default=os.cpu_count(), help="Process pour le prétraitement et l_extraction")
+    parser.add_argument("--concurrence", type=int, default=4, help="Appels Vision simultanés")
+    parser.add_argument("--lot-ocr", type=int, default=MAX_IMAGES_PAR_APPEL_VISION, help="Images par appel Vision (max 16)")
+    parser.add_argument("--lot-sheet", type=int, default=500, help="Lignes par appel append_rows")
+    parser.add_argument("--timeout-ocr", type=float, default=60.0, help="Timeout d_un appel Vision (s)")
+    parser.add_argument("--max-dimension", type=int, default=1600, help="Réduction avant OCR (0 = aucune)")
+    parser.add_argument("--qualite-jpeg", type=int, default=85)
+    parser.add_argument("--couleur", action="store_true", help="Ne pas convertir en niveaux de gris")
+    parser.add_argument("--dry-run", action="store_true", help="Hors ligne : OCR rejoué depuis les fixtures, aucune écriture")
+    parser.add_argument("--fixtures", default="data/fixtures", help="Dossier de fixtures pour --dry-run (voir ocr_fixtures.py)")
+    parser.add_argument("--json", help="Écrit le résultat de chaque image traitée dans ce fichier")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    args.lot_ocr = max(1, min(args.lot_ocr, MAX_IMAGES_PAR_APPEL_VISION))
+
+    logging.basicConfig(format=FORMAT_LOG, level=args.log_level.upper())
+
+    if not os.path.exists(args.source):
+        print(f"Source introuvable: {args.source}", file=sys.stderr)
+        return 1
+    elements = lister_source(args.source)
+    if not elements:
+        print(f"Aucune image trouvée dans {args.source}", file=sys.stderr)
+        return 1
+
+    rattrapage = Rattrapage(args)
+    try:
+        rattrapage.ouvrir_clients()
+        asyncio.run(rattrapage.executer(elements))
+        comptes = rattrapage.checkpoint.compter()
+    except KeyboardInterrupt:
+        print("Interrompu : relancer la même commande pour reprendre.", file=sys.stderr)
+        return 130
+    except Exception as e:
+        logger.error(f"Rattrapage interrompu: {e}", exc_info=not isinstance(e, ErreurConfiguration))
+        print("Relancer la même commande pour reprendre là où le rattrapage s_est arrêté.", file=sys.stderr)
+        return 1
+    finally:
+        rattrapage.fermer()
+
+    statuts = {}
+    for resultat in rattrapage.rapport.values():
+        statuts[resultat["statut"]] = statuts.get(resultat["statut"], 0) + 1
+    print(f"{len(rattrapage.rapport)} image(s) traitée(s) : " + ", ".join(f"{statut} {n}" for statut, n in sorted(statuts.items())))
+    if args.dry_run:
+        print(f"{len(rattrapage.lignes_simulees)} ligne(s) auraient été ajoutées dans Google Sheets.")
+    else:
+        print("Checkpoint : " + ", ".join(f"{statut} {n}" for statut, n in sorted(comptes.items())))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {"resultats": list(rattrapage.rapport.values()), "lignes": rattrapage.lignes_simulees if args.dry_run else None},
+                f, ensure_ascii=False, indent=2,
+            )
+    return 0 if not statuts.get(ERREUR) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Benchmark hors ligne de l_extraction OCR sur un corpus de fixtures.
+
+Rejoue les réponses Vision enregistrées (voir ocr_fixtures.py / OCR_FIXTURES_DIR dans main.py)
+à travers identifier_reseau_et_username_par_ocr, extraire_followers_spatial et
+normaliser_nombre_followers, sans réseau ni Telegram. Rapporte les percentiles de latence
+par étage, le débit (images/s), les allocations (tracemalloc) et, pour les fixtures
+étiquetées ("attendu"), la précision réseau / username / followers.
+
+Usage :
+    python bench_ocr.py data/fixtures --repetitions 10
+    python bench_ocr.py data/fixtures --json resultats.json --verbose
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+from extraction import (
+    MOTS_CLES_FOLLOWERS_SPECIFIQUES,
+    corriger_username,
+    extraire_followers_spatial,
+    identifier_reseau_et_username_par_ocr,
+    normaliser_nombre_followers,
+)
+from handle_matcher import HandleMatcher
+from ocr_fixtures import charger_fixtures
+
+
+def percentile(valeurs: list, p: float) -> float:
+    if not valeurs:
+        return 0.0
+    valeurs = sorted(valeurs)
+    rang = (len(valeurs) - 1) * p / 100
+    bas = int(rang)
+    haut = min(bas + 1, len(valeurs) - 1)
+    return valeurs[bas] + (valeurs[haut] - valeurs[bas]) * (rang - bas)
+
+
+def _etage_followers(fixture, resultat):
+    reseau = (resultat[0] or "").lower()
+    mots_cles = MOTS_CLES_FOLLOWERS_SPECIFIQUES.get(reseau)
+    if not mots_cles:
+        return None
+    return lambda: extraire_followers_spatial(fixture["annotations"], mots_cles, reseau)
+
+
+def _etage_normalisation(fixture):
+    textes = [a.description for a in fixture["annotations"][1:]]
+    return lambda: [normaliser_nombre_followers(t) for t in textes]
+
+
+def mesurer_latences(fixtures: list, matcher: HandleMatcher, repetitions: int) -> tuple:
+    latences = {"identification": [], "followers_spatial": [], "normalisation": []}
+    resultats = {}
+    # Échauffement : remplit les caches internes (regex, etc.) avant de mesurer
+    for fixture in fixtures:
+        resultats[fixture["chemin"]] = identifier_reseau_et_username_par_ocr(fixture["annotations"], matcher)
+
+    debut_total = time.perf_counter()
+    temps_identification = 0.0
+    for _ in range(repetitions):
+        for fixture in fixtures:
+            t0 = time.perf_counter_ns()
+            identifier_reseau_et_username_par_ocr(fixture["annotations"], matcher)
+            duree = time.perf_counter_ns() - t0
+            latences["identification"].append(duree / 1e6)
+            temps_identification += duree / 1e9
+
+            etage = _etage_followers(fixture, resultats[fixture["chemin"]])
+            if etage is not None:
+                t0 = time.perf_counter_ns()
+                etage()
+                latences["followers_spatial"].append((time.perf_counter_ns() - t0) / 1e6)
+
+            etage = _etage_normalisation(fixture)
+            t0 = time.perf_counter_ns()
+            etage()
+            latences["normalisation"].append((time.perf_counter_ns() - t0) / 1e6)
+    duree_totale = time.perf_counter() - debut_total
+
+    nb_images = len(fixtures) * repetitions
+    debit = nb_images / temps_identification if temps_identification else 0.0
+    return latences, resultats, {"images": nb_images, "duree_totale_s": duree_totale, "images_par_s": debit}
+
+
+def mesurer_allocations(fixtures: list, matcher: HandleMatcher) -> dict:
+    """Pic mémoire alloué (Kio) par image et par étage, mesuré avec tracemalloc (passe séparée)."""
+    pics = {"identification": [], "followers_spatial": [], "normalisation": []}
+    tracemalloc.start()
+    try:
+        for fixture in fixtures:
+            etages = [("identification", lambda f=fixture: identifier_reseau_et_username_par_ocr(f["annotations"], matcher))]
+            resultat = identifier_reseau_et_username_par_ocr(fixture["annotations"], matcher)
+            etage = _etage_followers(fixture, resultat)
+            if etage is not None:
+                etages.append(("followers_spatial", etage))
+            etages.append(("normalisation", _etage_normalisation(fixture)))
+            for nom, fonction in etages:
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                fonction()
+                _, pic = tracemalloc.get_traced_memory()
+                pics[nom].append((pic - base) / 1024)
+    finally:
+        tracemalloc.stop()
+    return pics
+
+
+def _normaliser_username(username):
+    return (username or "").lower().lstrip("@") or None
+
+
+def mesurer_precision(fixtures: list, resultats: dict) -> dict:
+    etiquetees = [f for f in fixtures if f.get("attendu")]
+    ok = {"reseau": 0, "username": 0, "followers": 0}
+    erreurs = []
+    for fixture in etiquetees:
+        attendu = fixture["attendu"]
+        reseau, username, followers = resultats[fixture["chemin"]]
+        if username:
+            username = corriger_username(username, (reseau or "").lower())
+        comparaisons = {
+            "reseau": (reseau or "").lower() == (attendu.get("reseau") or "").lower(),
+            "username": _normaliser_username(username) == _normaliser_username(attendu.get("username")),
+            "followers": str(followers or "") == str(attendu.get("followers") or ""),
+        }
+        for champ, correct in comparaisons.items():
+            if correct:
+                ok[champ] += 1
+        if not all(comparaisons.values()):
+            erreurs.append({
+                "fixture": fixture["chemin"],
+                "attendu": attendu,
+                "obtenu": {"reseau": reseau, "username": username, "followers": followers},
+            })
+    total = len(etiquetees)
+    return {
+        "etiquetees": total,
+        "precision": {champ: (n / total if total else None) for champ, n in ok.items()},
+        "erreurs": erreurs,
+    }
+
+
+def resumer(valeurs: list) -> dict:
+    return {
+        "n": len(valeurs),
+        "p50": percentile(valeurs, 50),
+        "p90": percentile(valeurs, 90),
+        "p99": percentile(valeurs, 99),
+        "max": max(valeurs) if valeurs else 0.0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne de l_extraction OCR.")
+    parser.add_argument("fixtures", help="Dossier de fixtures JSON (voir ocr_fixtures.py)")
+    parser.add_argument("--handles", default="known_handles.json", help="Fichier known_handles.json")
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--sans-allocations", action="store_true", help="Ne pas lancer la passe tracemalloc")
+    parser.add_argument("--json", help="Écrit le rapport complet dans ce fichier")
+    parser.add_argument("--log-level", default="ERROR", help="Niveau de log pendant les mesures")
+    parser.add_argument("--verbose", action="store_true", help="Affiche chaque fixture en erreur")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=args.log_level.upper())
+
+    fixtures = charger_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"Aucune fixture trouvée dans {args.fixtures}", file=sys.stderr)
+        return 1
+    matcher = HandleMatcher(args.handles)
+
+    latences, resultats, debit = mesurer_latences(fixtures, matcher, args.repetitions)
+    rapport = {
+        "fixtures": len(fixtures),
+        "repetitions": args.repetitions,
+        "debit": debit,
+        "latences_ms": {etage: resumer(v) for etage, v in latences.items()},
+        "precision": mesurer_precision(fixtures, resultats),
+    }
+    if not args.sans_allocations:
+        rapport["allocations_kio"] = {etage: resumer(v) for etage, v in mesurer_allocations(fixtures, matcher).items()}
+
+    print(f"{len(fixtures)} fixtures x {args.repetitions} répétitions - {debit['images_par_s']:.1f} images/s")
+    print(f"{'étage':<20}{'n':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for etage, r in rapport["latences_ms"].items():
+        print(f"{etage:<20}{r['n']:>8}{r['p50']:>10.3f}{r['p90']:>10.3f}{r['p99']:>10.3f}{r['max']:>10.3f}")
+    if "allocations_kio" in rapport:
+        print(f"{'pic alloc. (Kio)':<20}{'n':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+        for etage, r in rapport["allocations_kio"].items():
+            print(f"{etage:<20}{r['n']:>8}{r['p50']:>10.1f}{r['p90']:>10.1f}{r['p99']:>10.1f}{r['max']:>10.1f}")
+
+    precision = rapport["precision"]
+    if precision["etiquetees"]:
+        print(f"Précision sur {precision['etiquetees']} fixtures étiquetées : "
+              + ", ".join(f"{champ} {valeur:.1%}" for champ, valeur in precision["precision"].items()))
+        if args.verbose:
+            for erreur in precision["erreurs"]:
+                print(f"  ✗ {erreur['fixture']}: attendu {erreur['attendu']}, obtenu {erreur['obtenu']}")
+    else:
+        print("Aucune fixture étiquetée (champ \"attendu\") : précision non mesurée.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rapport, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""Création des clients Google (Sheets, Vision) à partir des variables d_environnement.
+
+Partagé par le bot (main.py, via demarrage.py) et par l_outil de rattrapage (backfill.py).
+Une variable manquante ou un JSON invalide lève ErreurConfiguration : inutile de réessayer.
+"""
+import json
+import logging
+import os
+
+import gspread
+from google.oauth2.service_account import Credentials as ServiceAccountCredentials
+
+from demarrage import ErreurConfiguration
+
+logger = logging.getLogger(__name__)
+
+
+def _lire_credentials(variable: str) -> dict:
+    creds_json = os.getenv(variable)
+    if not creds_json:
+        raise ErreurConfiguration(f"La variable d_environnement {variable} n_est pas définie.")
+    try:
+        return json.loads(creds_json)
+    except ValueError as e:
+        raise ErreurConfiguration(f"{variable} n_est pas un JSON valide: {e}")
+
+
+def ouvrir_feuille(spreadsheet_id: str | None = None):
+    spreadsheet_id = spreadsheet_id or os.getenv("SPREADSHEET_ID")
+    if not spreadsheet_id:
+        raise ErreurConfiguration("La variable d_environnement SPREADSHEET_ID n_est pas définie.")
+    creds_dict = _lire_credentials("GOOGLE_APPLICATION_CREDENTIALS_GSPREAD")
+    gspread_creds = ServiceAccountCredentials.from_service_account_info(creds_dict, scopes=["https://www.googleapis.com/auth/spreadsheets"])
+    gc = gspread.authorize(gspread_creds)
+    sheet = gc.open_by_key(spreadsheet_id).sheet1
+    logger.info("Connexion à Google Sheets réussie.")
+    return sheet
+
+
+def creer_client_vision():
+    # Import différé : google.cloud.vision est long à importer (en parallèle de Sheets au démarrage du bot)
+    from google.cloud import vision
+    creds_dict = _lire_credentials("GOOGLE_APPLICATION_CREDENTIALS")
+    vision_creds = ServiceAccountCredentials.from_service_account_info(creds_dict)
+    client = vision.ImageAnnotatorClient(credentials=vision_creds)
+    logger.info("Client Google Vision AI initialisé avec succès.")
+    return client
@@ -0,0 +1,99 @@
+"""Index de déduplication des photos déjà traitées.
+
+Clé : `file_unique_id` Telegram (stable entre bots et entre redémarrages, contrairement à `file_id`).
+Front LRU en mémoire (O(1), borné) adossé à une table SQLite locale avec compaction par TTL,
+pour que les updates rejouées après un redémarrage ne repartent pas à l_OCR ni dans le Sheet.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DedupIndex:
+    def __init__(self, chemin: str, taille_lru: int = 10000, ttl_s: float = 30 * 24 * 3600,
+                 compaction_toutes_les: int = 1000):
+        self.taille_lru = taille_lru
+        self.ttl_s = ttl_s
+        self.compaction_toutes_les = compaction_toutes_les
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._insertions_depuis_compaction = 0
+
+        dossier = os.path.dirname(chemin)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        self._conn = sqlite3.connect(chemin, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deja_traites ("
+            " cle TEXT PRIMARY KEY,"
+            " vu_le REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_deja_traites_vu_le ON deja_traites (vu_le)")
+        self.compacter()
+
+    def _memoriser(self, cle: str, vu_le: float):
+        self._lru[cle] = vu_le
+        self._lru.move_to_end(cle)
+        if len(self._lru) > self.taille_lru:
+            self._lru.popitem(last=False)
+
+    def deja_vu(self, cle: str) -> bool:
+        maintenant = time.time()
+        with self._lock:
+            vu_le = self._lru.get(cle)
+            if vu_le is not None:
+                if maintenant - vu_le <= self.ttl_s:
+                    self._lru.move_to_end(cle)
+                    return True
+                del self._lru[cle]
+            row = self._conn.execute("SELECT vu_le FROM deja_traites WHERE cle = ?", (cle,)).fetchone()
+            if row and maintenant - row[0] <= self.ttl_s:
+                self._memoriser(cle, row[0])
+                return True
+            return False
+
+    def reserver(self, cle: str) -> bool:
+        """Marque `cle` comme traitée. Retourne False si elle l_était déjà (check-and-set atomique)."""
+        if self.deja_vu(cle):
+            return False
+        maintenant = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO deja_traites (cle, vu_le) VALUES (?, ?)"
+                " ON CONFLICT(cle) DO UPDATE SET vu_le = excluded.vu_le WHERE vu_le < ?",
+                (cle, maintenant, maintenant - self.ttl_s),
+            )
+            if cur.rowcount == 0:
+                # Réservée entre-temps par un autre process
+                return False
+            self._memoriser(cle, maintenant)
+            self._insertions_depuis_compaction += 1
+            compaction_due = self._insertions_depuis_compaction >= self.compaction_toutes_les
+        if compaction_due:
+            self.compacter()
+        return True
+
+    def liberer(self, cle: str):
+        """Annule une réservation (traitement échoué, la photo pourra être retraitée)."""
+        with self._lock:
+            self._lru.pop(cle, None)
+            self._conn.execute("DELETE FROM deja_traites WHERE cle = ?", (cle,))
+
+    def compacter(self):
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM deja_traites WHERE vu_le < ?", (time.time() - self.ttl_s,))
+            self._insertions_depuis_compaction = 0
+        if cur.rowcount:
+            logger.info(f"DedupIndex: {cur.rowcount} entrées expirées supprimées.")
+
+    def fermer(self):
+        with self._lock:
+            self._conn.close()
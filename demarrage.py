@@ -0,0 +1,108 @@
+"""Initialisation des clients externes (Sheets, Vision) en tâche de fond.
+
+Chaque composant est créé dans un thread, en parallèle des autres, sans bloquer le
+démarrage de l_app : la réception Telegram fonctionne tout de suite (les photos vont dans
+la file durable) et les workers attendent que les composants dont ils ont besoin soient
+prêts. Les échecs sont retentés avec backoff ; seule une erreur de configuration
+(variable manquante, JSON invalide) arrête les essais. L_état de chaque composant est
+exposé par /healthz et /readyz.
+"""
+import asyncio
+import contextlib
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ErreurConfiguration(Exception):
+    """Erreur qu_un nouvel essai ne corrigera pas (variable d_environnement manquante, etc.)."""
+
+
+class Composant:
+    def __init__(self, nom: str, fabrique, sur_pret=None, backoff_initial_s: float = 1.0,
+                 backoff_max_s: float = 60.0):
+        self.nom = nom
+        self.fabrique = fabrique
+        self.sur_pret = sur_pret
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        self.valeur = None
+        self.etat = "en_attente"
+        self.tentatives = 0
+        self.derniere_erreur = None
+        self.duree_s = None
+        self._pret = asyncio.Event()
+
+    @property
+    def pret(self) -> bool:
+        return self._pret.is_set()
+
+    async def attendre(self):
+        await self._pret.wait()
+        return self.valeur
+
+    async def initialiser(self):
+        debut = time.perf_counter()
+        delai = self.backoff_initial_s
+        while True:
+            self.tentatives += 1
+            try:
+                self.valeur = await asyncio.to_thread(self.fabrique)
+                break
+            except ErreurConfiguration as e:
+                self.etat, self.derniere_erreur = "erreur", str(e)
+                logger.error(f"{self.nom}: configuration invalide, initialisation abandonnée: {e}")
+                return
+            except Exception as e:
+                self.etat, self.derniere_erreur = "nouvel_essai", str(e)
+                attente = min(delai, self.backoff_max_s) * (0.5 + random.random() / 2)
+                logger.warning(f"{self.nom}: initialisation échouée (tentative {self.tentatives}): {e}. Nouvel essai dans {attente:.1f}s.")
+                await asyncio.sleep(attente)
+                delai *= 2
+        if self.sur_pret is not None:
+            self.sur_pret(self.valeur)
+        self.duree_s = time.perf_counter() - debut
+        self.etat, self.derniere_erreur = "pret", None
+        self._pret.set()
+        logger.info(f"{self.nom}: prêt en {self.duree_s:.2f}s ({self.tentatives} tentative(s)).")
+
+    def decrire(self) -> dict:
+        return {
+            "etat": self.etat,
+            "tentatives": self.tentatives,
+            "erreur": self.derniere_erreur,
+            "duree_s": round(self.duree_s, 3) if self.duree_s is not None else None,
+        }
+
+
+class Demarrage:
+    def __init__(self, *composants: Composant):
+        self.composants = {composant.nom: composant for composant in composants}
+        self._taches = []
+
+    def __getitem__(self, nom: str) -> Composant:
+        return self.composants[nom]
+
+    def lancer(self):
+        """Lance toutes les initialisations en parallèle (idempotent)."""
+        if not self._taches:
+            self._taches = [
+                asyncio.create_task(composant.initialiser(), name=f"init-{composant.nom}")
+                for composant in self.composants.values() if not composant.pret
+            ]
+
+    async def arreter(self):
+        for tache in self._taches:
+            tache.cancel()
+        for tache in self._taches:
+            with contextlib.suppress(asyncio.CancelledError):
+                await tache
+        self._taches = []
+
+    def pret(self) -> bool:
+        return all(composant.pret for composant in self.composants.values())
+
+    def etat(self) -> dict:
+        return {nom: composant.decrire() for nom, composant in self.composants.items()}
@@ -0,0 +1,383 @@
+"""Extraction réseau / username / followers à partir des annotations OCR.
+
+Fonctions pures (aucun client Google ni Telegram) : utilisées par le bot, et rejouables
+hors ligne sur des fixtures (voir bench_ocr.py).
+"""
+import itertools
+import logging
+import re
+import traceback
+from array import array
+
+logger = logging.getLogger(__name__)
+
+def corriger_username(username: str, reseau: str) -> str:
+    if reseau == "instagram" and username.startswith("@"):
+        return username[1:]
+    return username
+
+# Regex compilées une fois pour toutes (appelées pour chaque annotation de chaque image)
+RE_FORMAT_NOMBRE = re.compile(r"^[\d.,]*[kKmM]?$", re.IGNORECASE)
+RE_PARTIE_NUMERIQUE = re.compile(r"^\d*\.?\d+$")
+RE_NON_CHIFFRES = re.compile(r"[^\d]")
+RE_FRAGMENT_NUMERIQUE = re.compile(r"[\d\s.,]+")
+RE_CHIFFRE = re.compile(r"\d")
+RE_NOMBRE_POTENTIEL = re.compile(r"^[\d.,\s]*[kKmMsS]?$", re.IGNORECASE)
+RE_HEURE = re.compile(r"\d{1,2}:\d{2}[\s\w]*", re.IGNORECASE)
+RE_USERNAME = re.compile(r"@([a-zA-Z0-9_.]+)")
+
+def normaliser_nombre_followers(nombre_str: str) -> str | None:
+    if not isinstance(nombre_str, str):
+        return None
+    nombre_str_test = nombre_str.replace(" ", "").strip()
+    if not RE_FORMAT_NOMBRE.match(nombre_str_test):
+        logger.debug("normaliser_nombre_followers: L_entrée \"%s\" (nettoyée en \"%s\") ne correspond pas au format attendu.", nombre_str, nombre_str_test)
+        return None
+    nombre_str_clean = nombre_str_test.lower()
+    valeur = None
+    try:
+        if "k" in nombre_str_clean:
+            num_part = nombre_str_clean.replace("k", "").replace(",", ".")
+            if not RE_PARTIE_NUMERIQUE.match(num_part):
+                logger.debug("normaliser_nombre_followers: Format k invalide pour \"%s\" (partie numérique: \"%s\")", nombre_str_clean, num_part)
+                return None
+            valeur = str(int(float(num_part) * 1000))
+        elif "m" in nombre_str_clean:
+            num_part = nombre_str_clean.replace("m", "").replace(",", ".")
+            if not RE_PARTIE_NUMERIQUE.match(num_part):
+                logger.debug("normaliser_nombre_followers: Format m invalide pour \"%s\" (partie numérique: \"%s\")", nombre_str_clean, num_part)
+                return None
+            valeur = str(int(float(num_part) * 1000000))
+        else:
+            nombre_final_digits = RE_NON_CHIFFRES.sub("", nombre_str_clean)
+            if not nombre_final_digits.isdigit():
+                logger.debug("normaliser_nombre_followers: \"%s\" (venant de \"%s\") n_est pas un digit après nettoyage final.", nombre_final_digits, nombre_str_clean)
+                return None
+            valeur = str(int(nombre_final_digits))
+    except ValueError as e:
+        logger.warning("normaliser_nombre_followers: ValueError lors de la conversion de \"%s\" (original: \"%s\"): %s", nombre_str_clean, nombre_str, e)
+        return None
+    return valeur
+
+# Seuils de fusion des fragments numériques Instagram ("12 345" découpé en "12" + "345")
+FUSION_Y_LINE_THRESHOLD = 20
+FUSION_X_SPACE_THRESHOLD_MIN = 1 # Doit être à droite
+FUSION_X_SPACE_THRESHOLD_MAX = 85 # Augmenté pour plus de flexibilité
+
+def _fusionner_annotations_numeriques_adjacentes_instagram(number_annotations_list: list, reseau_nom: str) -> list:
+    if reseau_nom != "instagram":
+        return number_annotations_list
+
+    logger.debug("_fusionner_annotations_numeriques_adjacentes_instagram: Tentative de fusion pour %d annotations.", len(number_annotations_list))
+
+    fragments = []
+    others = []
+    for ann in number_annotations_list:
+        text = ann.get("text", "").strip()
+        # Est un fragment numérique pur s_il ne contient que des chiffres, espaces, points, virgules
+        # ET ne contient pas de ':' (heure), 'k', 'm', 's' (pour éviter de fusionner "10" avec "k followers")
+        if RE_FRAGMENT_NUMERIQUE.fullmatch(text) and not any(c in text.lower() for c in [":", "k", "m", "s"]):
+            fragments.append(ann)
+        else:
+            others.append(ann)
+
+    if len(fragments) < 2:
+        logger.debug("_fusionner_annotations_numeriques_adjacentes_instagram: Pas assez de fragments (<2) ou aucun fragment trouvé pour tenter une fusion.")
+        return number_annotations_list # Retourne la liste originale (fragments + others)
+
+    fragments.sort(key=lambda ann: (ann["avg_y"], ann["avg_x"]))
+    # Coordonnées en tableaux compacts : la boucle interne n_accède plus aux dicts
+    frag_x = array("d", (ann["avg_x"] for ann in fragments))
+    frag_y = array("d", (ann["avg_y"] for ann in fragments))
+    
+    merged_fragments_successfully = []
+    used_fragment_indices = [False] * len(fragments)
+
+    for i in range(len(fragments)):
+        if used_fragment_indices[i]:
+            continue
+
+        current_group_anns = [fragments[i]]
+        current_group_texts = [fragments[i]["text"].strip()]
+        used_fragment_indices[i] = True # Marquer comme utilisé pour ce groupe potentiel
+        last_idx = i
+
+        for j in range(i + 1, len(fragments)):
+            if used_fragment_indices[j]: # Ne devrait pas arriver si la logique est correcte
+                continue
+
+            y_diff = abs(frag_y[last_idx] - frag_y[j])
+            x_diff_centers = frag_x[j] - frag_x[last_idx]
+
+            if y_diff < FUSION_Y_LINE_THRESHOLD and FUSION_X_SPACE_THRESHOLD_MIN < x_diff_centers < FUSION_X_SPACE_THRESHOLD_MAX:
+                current_group_texts.append(fragments[j]["text"].strip())
+                current_group_anns.append(fragments[j])
+                used_fragment_indices[j] = True # Marquer comme utilisé dans ce groupe
+                last_idx = j
+            elif x_diff_centers >= FUSION_X_SPACE_THRESHOLD_MAX or x_diff_centers <= 0: # Trop loin ou à gauche/superposé
+                break # Arrêter d_étendre ce groupe si le suivant est trop loin ou mal placé
+        
+        merged_text_with_spaces = " ".join(current_group_texts)
+        normalized_value = normaliser_nombre_followers(merged_text_with_spaces)
+
+        if normalized_value:
+            base_ann = current_group_anns[0]
+            confiances = [ann["confiance"] for ann in current_group_anns if ann.get("confiance") is not None]
+            merged_fragments_successfully.append({
+                "text": merged_text_with_spaces, 
+                "normalized": normalized_value,
+                "avg_y": base_ann["avg_y"],
+                "avg_x": base_ann["avg_x"],
+                "annotation": base_ann["annotation"],
+                "confiance": min(confiances) if confiances else None,
+            })
+            logger.debug("_fusionner_annotations_numeriques_adjacentes_instagram: Fusionné %s -> '%s' (normalisé: %s)", current_group_texts, merged_text_with_spaces, normalized_value)
+        else: # La fusion n_a pas donné un nombre valide, remettre les fragments originaux du groupe actuel
+            # On les ajoute simplement s_ils sont normalisables seuls.
+            for ann_in_failed_group in current_group_anns:
+                original_norm = normaliser_nombre_followers(ann_in_failed_group["text"])
+                if original_norm:
+                    merged_fragments_successfully.append({ 
+                        "text": ann_in_failed_group["text"],
+                        "normalized": original_norm,
+                        "avg_y": ann_in_failed_group["avg_y"],
+                        "avg_x": ann_in_failed_group["avg_x"],
+                        "annotation": ann_in_failed_group["annotation"],
+                        "confiance": ann_in_failed_group.get("confiance"),
+                    })
+    
+    # Quels fragments n_ont pas été inclus dans `merged_fragments_successfully` ?
+    # On reconstruit la liste des fragments traités.
+    # `merged_fragments_successfully` contient soit des groupes fusionnés, soit des fragments individuels (si leur groupe a échoué à la normalisation).
+    # On doit s_assurer de ne pas avoir de doublons et que tous les fragments originaux y sont représentés une fois.
+
+    # Simplification: `merged_fragments_successfully` est la liste des fragments après tentative de fusion.
+    # Elle devrait contenir tous les éléments de `fragments`, soit fusionnés, soit tels quels.
+    # On la combine avec `others`.
+
+    final_number_annotations = merged_fragments_successfully + others
+    
+    if len(final_number_annotations) != len(number_annotations_list):
+        logger.debug("_fusionner_annotations_numeriques_adjacentes_instagram: Taille de la liste modifiée. Avant: %d, Après: %d", len(number_annotations_list), len(final_number_annotations))
+    else:
+        logger.debug("_fusionner_annotations_numeriques_adjacentes_instagram: Taille de la liste inchangée après tentative de fusion.")
+
+    return final_number_annotations
+
+# Fenêtre de recherche du nombre autour d_un mot-clé followers (en pixels)
+SPATIAL_DY_MIN = -25
+SPATIAL_DY_MAX = 100
+SPATIAL_DX_MAX = 150
+
+class _IndexSpatial:
+    """Centres des annotations numériques en tableaux compacts + grille de buckets (ligne, colonne)."""
+    TAILLE_CELLULE_Y = 50
+    TAILLE_CELLULE_X = 150
+
+    def __init__(self, number_annotations_list: list):
+        self.xs = array("d", (ann["avg_x"] for ann in number_annotations_list))
+        self.ys = array("d", (ann["avg_y"] for ann in number_annotations_list))
+        self.grille = {}
+        for idx in range(len(self.xs)):
+            cellule = (int(self.ys[idx] // self.TAILLE_CELLULE_Y), int(self.xs[idx] // self.TAILLE_CELLULE_X))
+            self.grille.setdefault(cellule, []).append(idx)
+
+    def candidats(self, x: float, y: float):
+        """Indices des nombres dont la cellule recoupe la fenêtre de recherche autour de (x, y)."""
+        ligne_min = int((y + SPATIAL_DY_MIN) // self.TAILLE_CELLULE_Y)
+        ligne_max = int((y + SPATIAL_DY_MAX) // self.TAILLE_CELLULE_Y)
+        col_min = int((x - SPATIAL_DX_MAX) // self.TAILLE_CELLULE_X)
+        col_max = int((x + SPATIAL_DX_MAX) // self.TAILLE_CELLULE_X)
+        for ligne in range(ligne_min, ligne_max + 1):
+            for col in range(col_min, col_max + 1):
+                yield from self.grille.get((ligne, col), ())
+
+def extraire_followers_spatial(text_annotations, mots_cles_specifiques, reseau_nom="inconnu", details=None) -> str | None:
+    """Nombre de followers normalisé, ou None.
+
+    `details` (dict optionnel) reçoit "source" : "mots_cles" si le nombre est le plus proche
+    d_un mot-clé followers, "repli" s_il vient d_une heuristique de secours (nombre du milieu,
+    plus grand nombre) ; et "confiance" : confiance OCR du nombre retenu (Tesseract) ou None.
+    """
+    if details is None:
+        details = {}
+    try:
+        logger.debug("extraire_followers_spatial (%s): --- Début de l_extraction spatiale ---", reseau_nom)
+        keyword_annotations_list = []
+        number_annotations_list = []
+
+        if not text_annotations:
+            logger.warning("extraire_followers_spatial (%s): Aucune annotation de texte fournie.", reseau_nom)
+            return None
+        
+        logger.debug("extraire_followers_spatial (%s): Nombre total d_annotations reçues: %d", reseau_nom, len(text_annotations))
+        # ... (logging des premières annotations)
+
+        mots_cles_lower = [keyword.lower() for keyword in mots_cles_specifiques]
+        for i, annotation in enumerate(itertools.islice(text_annotations, 1, None)):
+            try:
+                if not hasattr(annotation, 'description') or not hasattr(annotation, 'bounding_poly'):
+                    continue
+                text = annotation.description.lower().strip()
+                if not hasattr(annotation.bounding_poly, 'vertices') or len(annotation.bounding_poly.vertices) < 4:
+                    continue
+                vertices = annotation.bounding_poly.vertices
+                avg_y = (vertices[0].y + vertices[1].y + vertices[2].y + vertices[3].y) / 4
+                avg_x = (vertices[0].x + vertices[1].x + vertices[2].x + vertices[3].x) / 4
+
+                if any(keyword in text for keyword in mots_cles_lower):
+                    keyword_annotations_list.append({"text": text, "avg_y": avg_y, "avg_x": avg_x, "annotation": annotation})
+                
+                # Regex pour identifier les nombres potentiels (y compris avec k/m, espaces, points, virgules)
+                # Exclut les formats d_heure simples comme "10:30"
+                if RE_CHIFFRE.search(text) and RE_NOMBRE_POTENTIEL.match(text) and not RE_HEURE.fullmatch(text):
+                    nombre_normalise_test = normaliser_nombre_followers(text)
+                    if nombre_normalise_test:
+                        number_annotations_list.append({"text": text, "normalized": nombre_normalise_test, "avg_y": avg_y, "avg_x": avg_x, "annotation": annotation,
+                                                        "confiance": getattr(annotation, "confiance", None)})
+            except Exception as e_loop_ann:
+                logger.error("extraire_followers_spatial (%s): ERREUR INATTENDUE lors du traitement de l_annotation %d: %s", reseau_nom, i, e_loop_ann)
+                continue 
+
+        logger.debug("extraire_followers_spatial (%s): Fin de la boucle d_analyse des annotations.", reseau_nom)
+        logger.debug("extraire_followers_spatial (%s): Nombre de mots-clés trouvés: %d", reseau_nom, len(keyword_annotations_list))
+        logger.debug("extraire_followers_spatial (%s): Nombre de nombres potentiels trouvés AVANT fusion: %d", reseau_nom, len(number_annotations_list))
+
+        if reseau_nom == "instagram":
+            number_annotations_list = _fusionner_annotations_numeriques_adjacentes_instagram(number_annotations_list, reseau_nom)
+            logger.debug("extraire_followers_spatial (%s): Nombre de nombres potentiels trouvés APRES fusion: %d", reseau_nom, len(number_annotations_list))
+
+        # Détail par nombre : la boucle n_est même pas parcourue hors mode debug
+        if logger.isEnabledFor(logging.DEBUG):
+            for idx, na in enumerate(number_annotations_list):
+                logger.debug("  - Nombre %d (post-fusion): %s (normalisé: %s) à y=%s", idx, na['text'], na['normalized'], na['avg_y'])
+
+        if not keyword_annotations_list:
+            logger.warning("extraire_followers_spatial (%s): Aucun mot-clé de followers trouvé. Tentative de fallback.", reseau_nom)
+            if len(number_annotations_list) >= 3:
+                number_annotations_list.sort(key=lambda ann: ann['avg_x'])
+                if (abs(number_annotations_list[0]['avg_y'] - number_annotations_list[1]['avg_y']) < 30 and 
+                    abs(number_annotations_list[1]['avg_y'] - number_annotations_list[2]['avg_y']) < 30):
+                    details.update(source="repli", confiance=number_annotations_list[1]['confiance'])
+                    return number_annotations_list[1]['normalized']
+            return None
+
+        # Seules les cellules de la grille autour de chaque mot-clé sont examinées (au lieu de K x N paires).
+        # Départage identique à l_ancienne double boucle : plus petite distance, puis premier mot-clé, puis premier nombre.
+        index_nombres = _IndexSpatial(number_annotations_list)
+        best_key = None
+        for kw_idx, kw_ann in enumerate(keyword_annotations_list):
+            kw_x, kw_y = kw_ann['avg_x'], kw_ann['avg_y']
+            for num_idx in index_nombres.candidats(kw_x, kw_y):
+                y_diff = index_nombres.ys[num_idx] - kw_y
+                x_diff = abs(kw_x - index_nombres.xs[num_idx])
+                if SPATIAL_DY_MIN < y_diff < SPATIAL_DY_MAX and x_diff < SPATIAL_DX_MAX:
+                    distance = (y_diff**2 + x_diff**2)**0.5
+                    cle = (distance, kw_idx, num_idx)
+                    if best_key is None or cle < best_key:
+                        best_key = cle
+        best_candidate = number_annotations_list[best_key[2]]['normalized'] if best_key else None
+        
+        if best_candidate:
+            details.update(source="mots_cles", confiance=number_annotations_list[best_key[2]]['confiance'])
+            return best_candidate
+        else:
+            logger.warning("extraire_followers_spatial (%s): Aucun candidat sélectionné. Fallback sur le plus grand nombre.", reseau_nom)
+            if number_annotations_list:
+                number_annotations_list.sort(key=lambda x: int(x.get("normalized", "0") or "0"), reverse=True)
+                if number_annotations_list and number_annotations_list[0]['normalized']:
+                     details.update(source="repli", confiance=number_annotations_list[0]['confiance'])
+                     return number_annotations_list[0]['normalized']
+            return None
+
+    except Exception as e_global_spatial:
+        logger.error("extraire_followers_spatial (%s): ERREUR GLOBALE INATTENDUE: %s", reseau_nom, e_global_spatial)
+        logger.error(traceback.format_exc())
+        return None
+
+# Keywords pour chaque réseau
+MOTS_CLES_RESEAUX = {
+    "instagram": ["profil", "publications", "followers", "suivi(e)s", "modifier profil", "voir les traductions"],
+    "twitter": ["profil", "abonnements", "abonnés", "tweets", "éditer le profil"],
+    "threads": ["profil", "followers", "threads", "réponses", "republications"],
+    "tiktok": ["profil", "abonnements", "followers", "j_aime", "modifier le profil", "partager le profil"]
+}
+MOTS_CLES_FOLLOWERS_SPECIFIQUES = {
+    "instagram": ["followers", "abonnés"], # Le nombre est au-dessus
+    "twitter": ["abonnés", "followers"],    # Le nombre est à gauche
+    "threads": ["followers"],            # Le nombre est à gauche
+    "tiktok": ["followers", "abonnés"]     # Le nombre est au-dessus
+}
+
+def identifier_reseau_et_username_par_ocr(text_annotations, handle_matcher, details=None):
+    """(réseau, username, followers).
+
+    `details` (dict optionnel) reçoit "identification" : "known_handles" si le compte vient
+    de handle_matcher, sinon "mots_cles" ou None ; plus les clés de extraire_followers_spatial.
+    """
+    if details is None:
+        details = {}
+    full_text_ocr = text_annotations[0].description.lower() if text_annotations else ""
+    logger.debug("Texte OCR complet pour identification: %.500s...", full_text_ocr)
+
+    # Identification du réseau et de l_username
+    reseau_nom = "Inconnu"
+    username_ocr = None
+    followers = None
+    details["identification"] = None
+
+    # 1. Essayer d_identifier le réseau via les known_handles (plus fiable)
+    # Une seule passe sur le texte ; le handle le plus long l_emporte (talia_srzz avant talia_srz)
+    correspondance = handle_matcher.chercher(full_text_ocr)
+    if correspondance:
+        reseau_nom, username_ocr = correspondance
+        details["identification"] = "known_handles"
+        logger.debug("Correspondance trouvée via known_handles: Réseau='%s', User='%s'", reseau_nom, username_ocr)
+    
+    # 2. Si non trouvé par known_handles, essayer par mots-clés génériques du réseau
+    if not username_ocr:
+        logger.debug("Aucune correspondance via known_handles. Tentative par mots-clés génériques.")
+        best_match_reseau = None
+        max_keyword_count = 0
+        for net, keywords in MOTS_CLES_RESEAUX.items():
+            count = sum(1 for kw in keywords if kw in full_text_ocr)
+            if count > max_keyword_count:
+                max_keyword_count = count
+                best_match_reseau = net
+        
+        if best_match_reseau and max_keyword_count > 1: # Nécessite au moins 2 mots-clés pour réduire les faux positifs
+            reseau_nom = best_match_reseau.capitalize()
+            details["identification"] = "mots_cles"
+            logger.debug("Réseau identifié par mots-clés génériques: '%s' (count: %d)", reseau_nom, max_keyword_count)
+            # Essayer d_extraire un @username si possible pour ce réseau
+            match_username = RE_USERNAME.search(full_text_ocr)
+            if match_username:
+                username_ocr = match_username.group(1)
+                logger.debug("Username extrait par regex après identification réseau: '%s'", username_ocr)
+            else: # Si pas de @username, chercher un nom probable près des mots-clés (plus complexe, pour plus tard)
+                logger.warning("Réseau '%s' identifié, mais pas de @username trouvé par regex.", reseau_nom)
+        else:
+            logger.warning("Identification du réseau par mots-clés génériques incertaine ou échouée.")
+
+    # 3. Extraction des followers si réseau identifié (même si username pas parfait)
+    if reseau_nom != "Inconnu":
+        current_mots_cles_followers = MOTS_CLES_FOLLOWERS_SPECIFIQUES.get(reseau_nom.lower(), [])
+        if not current_mots_cles_followers:
+            logger.warning("Pas de mots-clés followers spécifiques pour le réseau %s", reseau_nom)
+        else:
+            logger.debug("Utilisation des mots-clés followers pour %s: %s", reseau_nom, current_mots_cles_followers)
+            followers = extraire_followers_spatial(text_annotations, current_mots_cles_followers, reseau_nom.lower(), details)
+            if followers:
+                logger.debug("Followers extraits pour %s: %s", reseau_nom, followers)
+            else:
+                logger.warning("Échec de l_extraction des followers pour %s avec la méthode spatiale.", reseau_nom)
+    else:
+        logger.warning("Réseau non identifié, impossible d_extraire les followers.")
+
+    # Si username_ocr n_est toujours pas trouvé mais réseau oui, on peut tenter un fallback plus tard
+    if not username_ocr and reseau_nom != "Inconnu":
+        logger.warning("Réseau %s identifié, mais username_ocr est None. OCR complet utilisé comme fallback pour nom de compte.", reseau_nom)
+        # On pourrait essayer de prendre le premier mot proéminent comme username, mais risqué.
+        # Pour l_instant, on ne met rien si pas de @user ou de known_handle.
+
+    return reseau_nom, username_ocr, followers
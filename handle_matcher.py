@@ -0,0 +1,121 @@
+"""Recherche des handles connus (known_handles.json) dans le texte OCR en une seule passe.
+
+Tous les handles sont compilés une fois dans une regex en forme de trie
+(`talia_srz(?:z)?`, ...) : à chaque position du texte, le moteur ne suit qu_un chemin
+du trie et le quantificateur gourmand donne la correspondance la plus longue. Entre deux
+correspondances qui se chevauchent, la plus longue l_emporte (talia_srzz plutôt que
+talia_srz) ; parmi celles qui restent, la première dans le texte (le handle du profil est
+en haut de la capture, un autre handle cité dans la bio vient après). Le fichier est
+rechargé (et la regex reconstruite puis échangée atomiquement) quand il change sur disque.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _trie_vers_regex(noeud: dict) -> str:
+    fin = "" in noeud
+    branches = [re.escape(c) + _trie_vers_regex(enfant) for c, enfant in sorted(noeud.items()) if c != ""]
+    if not branches:
+        return ""
+    if len(branches) == 1 and not fin:
+        return branches[0]
+    motif = "(?:" + "|".join(branches) + ")"
+    return motif + "?" if fin else motif
+
+
+def compiler_handles(known_handles: dict):
+    """known_handles.json -> (regex compilée, {handle en minuscules: (reseau, handle)})."""
+    index = {}
+    for handle_type, handles_list in known_handles.items():
+        for handle_info in handles_list:
+            # Format actuel : simples chaînes. Format objet {"id": ..., "reseau": ...} toléré.
+            if isinstance(handle_info, dict):
+                handle = handle_info["id"]
+                reseau = handle_info.get("reseau", handle_type.capitalize())
+            else:
+                handle = handle_info
+                reseau = handle_type.capitalize()
+            cle = handle.lower().lstrip("@")
+            if cle and cle not in index:  # Premier réseau listé prioritaire, comme avant
+                index[cle] = (reseau, handle)
+
+    trie = {}
+    for cle in index:
+        noeud = trie
+        for c in cle:
+            noeud = noeud.setdefault(c, {})
+        noeud[""] = {}
+    # Lookahead capturant : une correspondance (la plus longue) par position, chevauchements compris
+    regex = re.compile(f"(?=({_trie_vers_regex(trie)}))") if index else None
+    return regex, index
+
+
+class HandleMatcher:
+    def __init__(self, chemin: str, intervalle_verification_s: float = 5.0):
+        self.chemin = chemin
+        self.intervalle_verification_s = intervalle_verification_s
+        self._lock = threading.Lock()
+        self._derniere_verification = 0.0
+        self._mtime = None
+        # (regex, index) remplacé d_un bloc : les lecteurs voient toujours un état cohérent
+        self._etat = (None, {})
+        self.recharger()
+
+    @property
+    def nb_handles(self) -> int:
+        return len(self._etat[1])
+
+    def recharger(self) -> bool:
+        with self._lock:
+            try:
+                mtime = os.stat(self.chemin).st_mtime_ns
+                with open(self.chemin, "r", encoding="utf-8") as f:
+                    known_handles = json.load(f)
+                self._etat = compiler_handles(known_handles)
+                self._mtime = mtime
+                logger.info(f"HandleMatcher: {self.nb_handles} handles chargés depuis {self.chemin}.")
+                return True
+            except Exception as e:
+                if self._etat[0] is None and not self._etat[1]:
+                    raise
+                logger.error(f"HandleMatcher: rechargement de {self.chemin} impossible, ancienne liste conservée: {e}")
+                return False
+            finally:
+                self._derniere_verification = time.monotonic()
+
+    def recharger_si_modifie(self):
+        if time.monotonic() - self._derniere_verification < self.intervalle_verification_s:
+            return
+        try:
+            mtime = os.stat(self.chemin).st_mtime_ns
+        except OSError as e:
+            logger.warning(f"HandleMatcher: {self.chemin} inaccessible ({e}), ancienne liste conservée.")
+            self._derniere_verification = time.monotonic()
+            return
+        if mtime != self._mtime:
+            self.recharger()
+        else:
+            self._derniere_verification = time.monotonic()
+
+    def chercher(self, texte: str):
+        """Retourne (reseau, handle) pour le premier handle connu de `texte` (chevauchements : le plus long), sinon None."""
+        self.recharger_si_modifie()
+        regex, index = self._etat
+        if regex is None:
+            return None
+        correspondances = [(m.start(), m.start() + len(m.group(1)), m.group(1)) for m in regex.finditer(texte.lower())]
+        # Les plus longues d_abord : une correspondance qui en chevauche une plus longue est écartée
+        correspondances.sort(key=lambda c: (c[0] - c[1], c[0]))
+        retenues = []
+        for debut, fin, trouve in correspondances:
+            if all(fin <= d or debut >= f for d, f, _ in retenues):
+                retenues.append((debut, fin, trouve))
+        if not retenues:
+            return None
+        return index[min(retenues)[2]]
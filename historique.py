@@ -0,0 +1,232 @@
+"""Historique local des relevés de followers (SQLite), pour /stats et /top sans passer par Sheets.
+
+Chaque ligne écrite dans Google Sheets ([horodatage, username, followers, réseau, posteur,
+file_id]) est aussi enregistrée ici, indexée sur (reseau, username, ts). Avant l_écriture,
+la valeur est comparée au dernier relevé fiable du compte : un saut improbable (erreur
+d_OCR, "1,2k" lu "12") est signalé et marqué suspect, et n_entre pas dans les statistiques.
+Le contenu existant de la feuille est importé une seule fois (importer_lignes_sheet).
+"""
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+FORMAT_HORODATAGE = "%Y-%m-%d %H:%M:%S"
+
+
+def normaliser_handle(handle: str) -> str:
+    return (handle or "").strip().lstrip("@").lower()
+
+
+def normaliser_reseau(reseau: str) -> str:
+    # Même casse que handle_matcher / extraction ("Instagram", "Tiktok"…)
+    return (reseau or "").strip().capitalize() or "Inconnu"
+
+
+def _vers_ts(horodatage) -> float | None:
+    try:
+        return datetime.datetime.strptime(str(horodatage).strip(), FORMAT_HORODATAGE).timestamp()
+    except ValueError:
+        return None
+
+
+def _vers_entier(followers) -> int | None:
+    try:
+        return int(str(followers).replace(" ", "").replace("\u00a0", ""))
+    except ValueError:
+        return None
+
+
+class HistoriqueFollowers:
+    def __init__(self, chemin: str, variation_max: float = 0.5, variation_min_abs: int = 100):
+        # Saut suspect : plus de `variation_max` (50 %) ET au moins `variation_min_abs` followers
+        self.variation_max = variation_max
+        self.variation_min_abs = variation_min_abs
+        dossier = os.path.dirname(chemin)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        self._conn = sqlite3.connect(chemin, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS mesures ("
+            " id INTEGER PRIMARY KEY,"
+            " ts REAL NOT NULL,"
+            " reseau TEXT NOT NULL COLLATE NOCASE,"
+            " username TEXT NOT NULL COLLATE NOCASE,"
+            " followers INTEGER NOT NULL,"
+            " posteur TEXT,"
+            " file_id TEXT UNIQUE,"
+            " suspect INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS idx_mesures_compte ON mesures (reseau, username, ts);"
+            "CREATE INDEX IF NOT EXISTS idx_mesures_ts ON mesures (ts);"
+            # /stats <handle> ne connaît pas le réseau
+            "CREATE INDEX IF NOT EXISTS idx_mesures_username ON mesures (username);"
+            "CREATE TABLE IF NOT EXISTS meta (cle TEXT PRIMARY KEY, valeur TEXT);"
+        )
+        self._lock = threading.Lock()
+
+    def _transaction(self, fonction):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultat = fonction()
+                self._conn.execute("COMMIT")
+                return resultat
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- Écriture -------------------------------------------------------------------
+
+    def _derniers(self, reseau: str, username: str):
+        """(dernier relevé fiable, dernier relevé tout court) : (followers, suspect) ou None."""
+        fiable = self._conn.execute(
+            "SELECT followers FROM mesures WHERE reseau = ? AND username = ? AND suspect = 0"
+            " ORDER BY ts DESC LIMIT 1", (reseau, username),
+        ).fetchone()
+        dernier = self._conn.execute(
+            "SELECT followers, suspect FROM mesures WHERE reseau = ? AND username = ?"
+            " ORDER BY ts DESC LIMIT 1", (reseau, username),
+        ).fetchone()
+        return fiable, dernier
+
+    def _est_coherent(self, reference: int, valeur: int) -> bool:
+        ecart = abs(valeur - reference)
+        if ecart < self.variation_min_abs:
+            return True
+        return reference > 0 and ecart / reference <= self.variation_max
+
+    def _verifier(self, reseau: str, username: str, followers: int) -> str | None:
+        """Motif si la valeur est improbable par rapport au dernier relevé fiable, sinon None."""
+        fiable, dernier = self._derniers(reseau, normaliser_handle(username))
+        if fiable is None or self._est_coherent(fiable[0], followers):
+            return None
+        # Deux relevés suspects concordants : c_est un vrai changement, pas une erreur d_OCR
+        if dernier is not None and dernier[1] and self._est_coherent(dernier[0], followers):
+            return None
+        variation = (followers - fiable[0]) / fiable[0] if fiable[0] else float("inf")
+        return f"variation suspecte: {fiable[0]} → {followers} ({variation:+.0%})"
+
+    def enregistrer(self, lignes: list) -> list:
+        """Lignes au format Sheets ; retourne, pour chaque ligne, le motif d_alerte ou None."""
+        def ecrire():
+            alertes = []
+            for horodatage, username, followers, reseau, posteur, file_id in lignes:
+                ts, valeur = _vers_ts(horodatage), _vers_entier(followers)
+                if ts is None or valeur is None or not username:
+                    alertes.append(None)
+                    continue
+                reseau = normaliser_reseau(reseau)
+                alerte = self._verifier(reseau, username, valeur)
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO mesures (ts, reseau, username, followers, posteur, file_id, suspect)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (ts, reseau, normaliser_handle(username), valeur, posteur, file_id or None, int(alerte is not None)),
+                )
+                alertes.append(alerte)
+            return alertes
+
+        return self._transaction(ecrire)
+
+    def import_fait(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE cle = 'import_sheet'").fetchone() is not None
+
+    def importer_lignes_sheet(self, lignes: list) -> int:
+        """Import unique du contenu de la feuille (get_all_values) ; ignoré s_il a déjà été fait."""
+        def importer():
+            if self._conn.execute("SELECT 1 FROM meta WHERE cle = 'import_sheet'").fetchone():
+                return 0
+            valeurs = []
+            for ligne in lignes:
+                ligne = list(ligne) + [""] * (6 - len(ligne))
+                ts, followers = _vers_ts(ligne[0]), _vers_entier(ligne[2])
+                if ts is None or followers is None or not ligne[1]:
+                    continue  # en-tête, ligne vide ou mal formée
+                valeurs.append((ts, normaliser_reseau(ligne[3]), normaliser_handle(ligne[1]), followers, ligne[4] or None, ligne[5] or None))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO mesures (ts, reseau, username, followers, posteur, file_id) VALUES (?, ?, ?, ?, ?, ?)",
+                valeurs,
+            )
+            self._conn.execute(
+                "INSERT INTO meta (cle, valeur) VALUES ('import_sheet', ?)",
+                (datetime.datetime.now().strftime(FORMAT_HORODATAGE),),
+            )
+            return len(valeurs)
+
+        return self._transaction(importer)
+
+    # --- Lecture ----------------------------------------------------------------------
+
+    def stats(self, handle: str, jours: float = 7) -> list:
+        """Évolution sur `jours` jours, un dict par réseau où le compte apparaît."""
+        username = normaliser_handle(handle)
+        debut = datetime.datetime.now().timestamp() - jours * 86400
+        with self._lock:
+            comptes = self._conn.execute(
+                "SELECT DISTINCT reseau FROM mesures WHERE username = ?", (username,)
+            ).fetchall()
+            resultats = []
+            for (reseau,) in comptes:
+                dernier = self._conn.execute(
+                    "SELECT ts, followers FROM mesures WHERE reseau = ? AND username = ? AND suspect = 0"
+                    " ORDER BY ts DESC LIMIT 1", (reseau, username),
+                ).fetchone()
+                if dernier is None:
+                    continue
+                # Référence : premier relevé de la fenêtre (ou, à défaut, le dernier avant)
+                reference = self._conn.execute(
+                    "SELECT ts, followers FROM mesures WHERE reseau = ? AND username = ? AND suspect = 0 AND ts >= ?"
+                    " ORDER BY ts LIMIT 1", (reseau, username, debut),
+                ).fetchone() or dernier
+                nb = self._conn.execute(
+                    "SELECT COUNT(*) FROM mesures WHERE reseau = ? AND username = ? AND suspect = 0 AND ts >= ?",
+                    (reseau, username, debut),
+                ).fetchone()[0]
+                resultats.append({
+                    "reseau": normaliser_reseau(reseau),
+                    "username": username,
+                    "dernier_ts": dernier[0],
+                    "followers": dernier[1],
+                    "reference_ts": reference[0],
+                    "variation": dernier[1] - reference[1],
+                    "variation_pct": (dernier[1] - reference[1]) / reference[1] if reference[1] else None,
+                    "releves": nb,
+                })
+        return resultats
+
+    def top(self, jours: float = 7, limite: int = 5) -> dict:
+        """Plus fortes hausses et baisses sur la période (entre premier et dernier relevé fiables)."""
+        debut = datetime.datetime.now().timestamp() - jours * 86400
+        with self._lock:
+            # Premier et dernier relevés dans la même requête : pas de jointure par clé en Python,
+            # qui casserait si un compte a des lignes "Instagram" et "instagram" (COLLATE NOCASE)
+            lignes = self._conn.execute(
+                "SELECT m.reseau, m.username,"
+                " (SELECT followers FROM mesures WHERE reseau = m.reseau AND username = m.username"
+                "  AND suspect = 0 AND ts >= ? ORDER BY ts LIMIT 1),"
+                " (SELECT followers FROM mesures WHERE reseau = m.reseau AND username = m.username"
+                "  AND suspect = 0 AND ts >= ? ORDER BY ts DESC LIMIT 1)"
+                " FROM mesures m WHERE m.ts >= ? AND m.suspect = 0 GROUP BY m.reseau, m.username",
+                (debut, debut, debut),
+            ).fetchall()
+        variations = []
+        for reseau, username, followers, fin in lignes:
+            variations.append({
+                "reseau": normaliser_reseau(reseau),
+                "username": username,
+                "followers": fin,
+                "variation": fin - followers,
+                "variation_pct": (fin - followers) / followers if followers else None,
+            })
+        hausses = sorted((v for v in variations if v["variation"] > 0), key=lambda v: v["variation"], reverse=True)
+        baisses = sorted((v for v in variations if v["variation"] < 0), key=lambda v: v["variation"])
+        return {"hausses": hausses[:limite], "baisses": baisses[:limite], "comptes": len(variations)}
+
+    def fermer(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,191 @@
+"""File de jobs durable entre la réception Telegram et les workers OCR / Sheets.
+
+L_intake pose un petit job (file_unique_id, file_id, chat, user, horodatage, variantes de
+la photo) ; les workers, dans ce process ou dans d_autres, le réclament avec un délai de
+visibilité : un job réclamé par un worker qui meurt redevient visible à l_expiration.
+Échecs retentés avec backoff, puis déplacés dans la table dead_letter.
+
+Backend par défaut : SQLite local (JOB_QUEUE_URL=sqlite:///data/jobs.sqlite3). D_autres
+backends s_enregistrent dans BACKENDS avec le même jeu de méthodes que FileSQLite.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class FileSQLite:
+    def __init__(self, chemin: str, max_tentatives: int = 5, backoff_initial_s: float = 5.0,
+                 backoff_max_s: float = 600.0):
+        self.max_tentatives = max_tentatives
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        dossier = os.path.dirname(chemin)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        self._conn = sqlite3.connect(chemin, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " file_unique_id TEXT NOT NULL UNIQUE,"
+            " chat_id INTEGER,"
+            " media_group_id TEXT,"
+            " payload TEXT NOT NULL,"
+            " cree_le REAL NOT NULL,"
+            " disponible_le REAL NOT NULL,"
+            " tentatives INTEGER NOT NULL DEFAULT 0,"
+            " reclame_par TEXT,"
+            " visible_le REAL,"
+            " derniere_erreur TEXT);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_disponibles ON jobs (disponible_le, visible_le);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_groupe ON jobs (media_group_id, chat_id);"
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            " id INTEGER PRIMARY KEY,"
+            " file_unique_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " tentatives INTEGER NOT NULL,"
+            " erreur TEXT,"
+            " mort_le REAL NOT NULL);"
+        )
+        self._lock = threading.Lock()
+
+    def _transaction(self, fonction):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                resultat = fonction()
+                self._conn.execute("COMMIT")
+                return resultat
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def ajouter(self, job: dict) -> bool:
+        """Pose un job. Retourne False s_il est déjà dans la file (même file_unique_id)."""
+        maintenant = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (file_unique_id, chat_id, media_group_id, payload, cree_le, disponible_le)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job["file_unique_id"], job.get("chat_id"), job.get("media_group_id"),
+                 json.dumps(job, ensure_ascii=False), maintenant, maintenant),
+            )
+        return cur.rowcount == 1
+
+    def reclamer_lot(self, taille_max: int, visibilite_s: float, age_min_album_s: float = 0.0,
+                     age_min_chat_s: float = 0.0) -> tuple:
+        """Réclame le plus ancien job disponible et ses voisins (même album, ou même chat hors album).
+
+        Un job n_est réclamable qu_après `age_min_*_s` : le temps que le reste de l_album arrive.
+        Retourne (liste de jobs, liste de jobs passés en dead letter).
+        """
+        jeton = uuid.uuid4().hex
+
+        def reclamer():
+            maintenant = time.time()
+            morts = []
+            while True:
+                premier = self._conn.execute(
+                    "SELECT id, media_group_id, chat_id, tentatives, payload FROM jobs"
+                    " WHERE disponible_le <= ? AND (visible_le IS NULL OR visible_le < ?)"
+                    " AND cree_le <= ? - (CASE WHEN media_group_id IS NULL THEN ? ELSE ? END)"
+                    " ORDER BY id LIMIT 1",
+                    (maintenant, maintenant, maintenant, age_min_chat_s, age_min_album_s),
+                ).fetchone()
+                if premier is None:
+                    return [], morts
+                # Réclamé trop souvent sans jamais être terminé (worker mort à chaque fois)
+                if premier[3] >= self.max_tentatives:
+                    morts.append(self._vers_dead_letter(premier[0], "visibilité expirée trop de fois", maintenant))
+                    continue
+                break
+            job_id, media_group_id, chat_id = premier[0], premier[1], premier[2]
+            if media_group_id is not None:
+                condition, valeur = "media_group_id = ?", media_group_id
+            else:
+                condition, valeur = "media_group_id IS NULL AND chat_id IS ?", chat_id
+            rows = self._conn.execute(
+                "SELECT id, payload, tentatives FROM jobs"
+                f" WHERE {condition} AND disponible_le <= ? AND (visible_le IS NULL OR visible_le < ?)"
+                " AND tentatives < ? ORDER BY id LIMIT ?",
+                (valeur, maintenant, maintenant, self.max_tentatives, taille_max),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET reclame_par = ?, visible_le = ?, tentatives = tentatives + 1 WHERE id = ?",
+                [(jeton, maintenant + visibilite_s, row[0]) for row in rows],
+            )
+            jobs = []
+            for row_id, payload, tentatives in rows:
+                job = json.loads(payload)
+                job["_id"] = row_id
+                job["_tentatives"] = tentatives + 1
+                jobs.append(job)
+            return jobs, morts
+
+        return self._transaction(reclamer)
+
+    def terminer(self, job: dict):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job["_id"],))
+
+    def echouer(self, job: dict, erreur: str) -> dict | None:
+        """Remet le job en file avec backoff, ou le passe en dead letter. Retourne le job mort le cas échéant."""
+        def echec():
+            maintenant = time.time()
+            if job["_tentatives"] >= self.max_tentatives:
+                return self._vers_dead_letter(job["_id"], erreur, maintenant)
+            delai = min(self.backoff_initial_s * 2 ** (job["_tentatives"] - 1), self.backoff_max_s)
+            self._conn.execute(
+                "UPDATE jobs SET reclame_par = NULL, visible_le = NULL, disponible_le = ?, derniere_erreur = ?"
+                " WHERE id = ?",
+                (maintenant + delai, erreur, job["_id"]),
+            )
+            return None
+
+        return self._transaction(echec)
+
+    def _vers_dead_letter(self, job_id: int, erreur: str, maintenant: float) -> dict:
+        file_unique_id, payload, tentatives = self._conn.execute(
+            "SELECT file_unique_id, payload, tentatives FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dead_letter (id, file_unique_id, payload, tentatives, erreur, mort_le)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, file_unique_id, payload, tentatives, erreur, maintenant),
+        )
+        self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        logger.error(f"Job {file_unique_id} passé en dead letter après {tentatives} tentative(s): {erreur}")
+        return json.loads(payload)
+
+    def profondeur(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def nb_dead_letters(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def fermer(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Backends disponibles, par schéma d_URL
+BACKENDS = {
+    "sqlite": lambda chemin, **options: FileSQLite(chemin, **options),
+}
+
+
+def ouvrir_file(url: str, **options):
+    """`sqlite:///data/jobs.sqlite3` -> FileSQLite("data/jobs.sqlite3")."""
+    schema, _, chemin = url.partition("://")
+    if schema not in BACKENDS:
+        raise ValueError(f"Backend de file inconnu: {schema!r} (disponibles: {', '.join(BACKENDS)})")
+    return BACKENDS[schema](chemin.removeprefix("/"), **options)
@@ -0,0 +1,109 @@
+"""Configuration des logs : identifiant de corrélation, JSON optionnel, émission asynchrone.
+
+- Chaque image traitée porte un identifiant de corrélation (son file_unique_id), posé
+  dans un ContextVar : il suit la tâche asyncio et les appels asyncio.to_thread, et se
+  retrouve dans chaque ligne de log.
+- LOG_FORMAT=json : un objet JSON par ligne, avec les champs passés en `extra=`.
+- Les handlers ne font pas d_I/O dans le thread appelant : les records passent par une
+  QueueHandler, un QueueListener (thread dédié) les écrit sur stderr.
+- Échantillonnage du debug : avec LOG_DEBUG_ECHANTILLON=0.05, seules 5 % des images
+  gardent leurs logs debug ; les autres sont écartés avant tout formatage. La décision
+  dépend de l_identifiant de l_image (CRC32, stable d_un process à l_autre) : tous les blocs
+  qui traitent la même image gardent ou écartent son debug ensemble.
+"""
+import atexit
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import uuid
+import zlib
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+debug_echantillonne = contextvars.ContextVar("debug_echantillonne", default=True)
+
+FORMAT_TEXTE = "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+_taux_debug = 1.0
+
+# Attributs standard d_un LogRecord : tout le reste vient d_un `extra=`
+_ATTRIBUTS_RECORD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id"}
+
+
+def debug_retenu(identifiant: str) -> bool:
+    """Décision d_échantillonnage du debug, identique pour toutes les entrées d_une même image."""
+    if _taux_debug >= 1.0:
+        return True
+    return zlib.crc32(identifiant.encode()) % 10000 < _taux_debug * 10000
+
+
+@contextlib.contextmanager
+def contexte_image(identifiant: str | None = None):
+    """Pose l_identifiant de corrélation (et la décision d_échantillonnage) pour le bloc."""
+    identifiant = identifiant or uuid.uuid4().hex[:12]
+    jeton_id = correlation_id.set(identifiant)
+    jeton_debug = debug_echantillonne.set(debug_retenu(identifiant))
+    try:
+        yield
+    finally:
+        debug_echantillonne.reset(jeton_debug)
+        correlation_id.reset(jeton_id)
+
+
+class FiltreContexte(logging.Filter):
+    """Ajoute correlation_id au record ; écarte le debug des images non échantillonnées."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and not debug_echantillonne.get():
+            return False
+        record.correlation_id = correlation_id.get() or "-"
+        return True
+
+
+class FormateurJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        donnees = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "niveau": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+        }
+        for cle, valeur in vars(record).items():
+            if cle not in _ATTRIBUTS_RECORD:
+                donnees[cle] = valeur
+        if record.exc_info:
+            donnees["exception"] = self.formatException(record.exc_info)
+        return json.dumps(donnees, ensure_ascii=False, default=str)
+
+
+def configurer_journalisation(niveau: str = "INFO", format_json: bool = False, taux_debug: float = 1.0,
+                              asynchrone: bool = True):
+    """Remplace la configuration de logging.basicConfig ; retourne le QueueListener éventuel."""
+    global _taux_debug
+    _taux_debug = taux_debug
+
+    sortie = logging.StreamHandler()
+    sortie.setFormatter(FormateurJSON() if format_json else logging.Formatter(FORMAT_TEXTE))
+
+    racine = logging.getLogger()
+    racine.setLevel(niveau.upper())
+    for handler in list(racine.handlers):
+        racine.removeHandler(handler)
+
+    if not asynchrone:
+        sortie.addFilter(FiltreContexte())
+        racine.addHandler(sortie)
+        return None
+
+    # QueueHandler ne résout que le message (et la trace d_exception) dans le thread appelant ;
+    # le formatage final (texte ou JSON) et l_écriture se font dans le thread du listener
+    entree = logging.handlers.QueueHandler(queue.SimpleQueue())
+    entree.addFilter(FiltreContexte())
+    racine.addHandler(entree)
+    listener = logging.handlers.QueueListener(entree.queue, sortie, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
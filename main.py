@@ -1,476 +1,826 @@
-import json
+import asyncio
+import atexit
+import contextlib
+import hmac
 import io
-import re
 import datetime
 import logging
+import multiprocessing
 import os
+import signal
+import sys
 import traceback # Assurez-vous que traceback est importé
-from difflib import get_close_matches
+from concurrent.futures import ThreadPoolExecutor
 
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from telegram import Update, Bot
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
-from PIL import Image, ImageOps
-import gspread
-from google.oauth2.service_account import Credentials as ServiceAccountCredentials
-from google.cloud import vision
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+
+from annotations import annotations_vers_dicts
+from clients_google import creer_client_vision, ouvrir_feuille
+from dedup import DedupIndex
+from demarrage import Composant, Demarrage, ErreurConfiguration
+from extraction import corriger_username, identifier_reseau_et_username_par_ocr
+from handle_matcher import HandleMatcher
+from historique import HistoriqueFollowers
+from job_queue import ouvrir_file
+from journalisation import configurer_journalisation, contexte_image
+from metrics import (
+    COMPTES_INCONNUS,
+    DEDUP_HITS,
+    DUREE_ETAPE,
+    ECHECS_OCR,
+    ERREURS_SHEETS,
+    IMAGES_TRAITEES,
+    JOBS_DEAD_LETTER,
+    OCR_CACHE,
+    OCR_ESCALADES,
+    OCR_NIVEAU,
+    REGISTRE,
+    boucle_resume,
+    profil_echantillonne,
+)
+from ocr_fixtures import enregistrer_fixture
+from ocr_cache import OcrCache, hash_contenu, hash_perceptuel
+from ocr_tesseract import OcrTesseract, tesseract_disponible
+from pretraitement import choisir_taille_photo, pretraiter_image, reprojeter_annotations
+from sheets_writer import SheetsBatchWriter
+from telegram_sender import EnvoyeurTelegram, normaliser_chat_id
+
+# Logs : LOG_FORMAT=json pour un objet JSON par ligne, LOG_DEBUG_ECHANTILLON pour ne garder
+# le debug que d_une fraction des images ; écriture dans un thread dédié (QueueListener)
+configurer_journalisation(
+    niveau=os.getenv("LOG_LEVEL", "INFO"),
+    format_json=os.getenv("LOG_FORMAT", "texte") == "json",
+    taux_debug=float(os.getenv("LOG_DEBUG_ECHANTILLON", "1")),
+    asynchrone=os.getenv("LOG_ASYNCHRONE", "1") == "1",
 )
 logger = logging.getLogger(__name__)
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-GROUP_ID = os.getenv("TELEGRAM_GROUP_ID")
-SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
-
-# Initialisation Google Sheets
-google_creds_gspread_json_str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_GSPREAD")
-if not google_creds_gspread_json_str:
-    logger.error("La variable d_environnement GOOGLE_APPLICATION_CREDENTIALS_GSPREAD n_est pas définie.")
-    exit()
-try:
-    creds_gspread_dict = json.loads(google_creds_gspread_json_str)
-    gspread_creds = ServiceAccountCredentials.from_service_account_info(creds_gspread_dict, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(gspread_creds)
-    sheet = gc.open_by_key(SPREADSHEET_ID).sheet1
-    logger.info("Connexion à Google Sheets réussie.")
-except Exception as e:
-    logger.error(f"Erreur lors de l_initialisation de Google Sheets: {e}")
-    logger.error(traceback.format_exc())
-    exit()
-
-# Initialisation Google Vision AI
-google_creds_vision_json_str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-if not google_creds_vision_json_str:
-    logger.error("La variable d_environnement GOOGLE_APPLICATION_CREDENTIALS (pour Vision) n_est pas définie.")
-    exit()
-try:
-    creds_vision_dict = json.loads(google_creds_vision_json_str)
-    vision_creds = ServiceAccountCredentials.from_service_account_info(creds_vision_dict)
-    vision_client = vision.ImageAnnotatorClient(credentials=vision_creds)
-    logger.info("Client Google Vision AI initialisé avec succès.")
-except Exception as e:
-    logger.error(f"Erreur lors de l_initialisation de Google Vision AI: {e}")
-    logger.error(traceback.format_exc())
-    exit()
-
-bot = Bot(TOKEN)
-already_processed = set()
-
-with open("known_handles.json", "r", encoding="utf-8") as f:
-    KNOWN_HANDLES = json.load(f)
-
-def corriger_username(username: str, reseau: str) -> str:
-    if reseau == "instagram" and username.startswith("@"):
-        return username[1:]
-    return username
-
-def normaliser_nombre_followers(nombre_str: str) -> str | None:
-    if not isinstance(nombre_str, str):
-        return None
-    nombre_str_test = nombre_str.replace(" ", "").strip()
-    if not re.match(r"^[\d.,]*[kKmM]?$", nombre_str_test, re.IGNORECASE):
-        logger.debug(f"normaliser_nombre_followers: L_entrée 	\"{nombre_str}\" (nettoyée en 	\"{nombre_str_test}\") ne correspond pas au format attendu.")
-        return None
-    nombre_str_clean = nombre_str_test.lower()
-    valeur = None
-    try:
-        if "k" in nombre_str_clean:
-            num_part = nombre_str_clean.replace("k", "").replace(",", ".")
-            if not re.match(r"^\d*\.?\d+$", num_part):
-                logger.debug(f"normaliser_nombre_followers: Format k invalide pour 	\"{nombre_str_clean}\" (partie numérique: 	\"{num_part}\")")
-                return None
-            valeur = str(int(float(num_part) * 1000))
-        elif "m" in nombre_str_clean:
-            num_part = nombre_str_clean.replace("m", "").replace(",", ".")
-            if not re.match(r"^\d*\.?\d+$", num_part):
-                logger.debug(f"normaliser_nombre_followers: Format m invalide pour 	\"{nombre_str_clean}\" (partie numérique: 	\"{num_part}\")")
-                return None
-            valeur = str(int(float(num_part) * 1000000))
-        else:
-            nombre_final_digits = re.sub(r"[^\d]", "", nombre_str_clean)
-            if not nombre_final_digits.isdigit():
-                logger.debug(f"normaliser_nombre_followers: 	\"{nombre_final_digits}\" (venant de 	\"{nombre_str_clean}\") n_est pas un digit après nettoyage final.")
-                return None
-            valeur = str(int(nombre_final_digits))
-    except ValueError as e:
-        logger.warning(f"normaliser_nombre_followers: ValueError lors de la conversion de 	\"{nombre_str_clean}\" (original: 	\"{nombre_str}\"): {e}")
-        return None
-    return valeur
-
-def _fusionner_annotations_numeriques_adjacentes_instagram(number_annotations_list: list, reseau_nom: str) -> list:
-    if reseau_nom != "instagram":
-        return number_annotations_list
-
-    logger.info(f"_fusionner_annotations_numeriques_adjacentes_instagram: Tentative de fusion pour {len(number_annotations_list)} annotations.")
-
-    fragments = []
-    others = []
-    for ann in number_annotations_list:
-        text = ann.get("text", "").strip()
-        # Est un fragment numérique pur s_il ne contient que des chiffres, espaces, points, virgules
-        # ET ne contient pas de ':' (heure), 'k', 'm', 's' (pour éviter de fusionner "10" avec "k followers")
-        if re.fullmatch(r"[\d\s.,]+", text) and not any(c in text.lower() for c in [":", "k", "m", "s"]):
-            fragments.append(ann)
-        else:
-            others.append(ann)
-
-    if len(fragments) < 2:
-        logger.info("_fusionner_annotations_numeriques_adjacentes_instagram: Pas assez de fragments (<2) ou aucun fragment trouvé pour tenter une fusion.")
-        return number_annotations_list # Retourne la liste originale (fragments + others)
-
-    fragments.sort(key=lambda ann: (ann["avg_y"], ann["avg_x"]))
-    
-    merged_fragments_successfully = []
-    used_fragment_indices = [False] * len(fragments)
-
-    for i in range(len(fragments)):
-        if used_fragment_indices[i]:
-            continue
+GROUP_ID = normaliser_chat_id(os.getenv("TELEGRAM_GROUP_ID"))
+
+def signaler_erreur_sheets(nb_lignes: int, erreur: Exception):
+    # Avis dédupliqué par l_envoyeur : un seul message tant que l_erreur se répète
+    envoyeur.signaler_erreur(
+        GROUP_ID,
+        f"⚠️ Erreur lors de l_écriture GSheet: {nb_lignes} ligne(s) mises de côté ({erreur}). "
+        "Elles seront renvoyées au prochain redémarrage.",
+    )
+
+# Écriture Sheets par lots (spool local + flush périodique en tâche de fond). Tant que
+# Sheets n_est pas prêt, les lignes restent dans le spool.
+sheets_writer = SheetsBatchWriter(
+    None,
+    spool_path=os.getenv("SHEETS_SPOOL_PATH", "data/sheets_spool.sqlite3"),
+    taille_lot=int(os.getenv("SHEETS_LOT_TAILLE", "50")),
+    intervalle_s=float(os.getenv("SHEETS_FLUSH_INTERVALLE_S", "5")),
+    sur_erreur_definitive=signaler_erreur_sheets,
+)
 
-        current_group_anns = [fragments[i]]
-        current_group_texts = [fragments[i]["text"].strip()]
-        used_fragment_indices[i] = True # Marquer comme utilisé pour ce groupe potentiel
+# Clients Google créés en parallèle, en tâche de fond, avec nouvel essai en cas d_échec
+# (voir demarrage.py) ; état exposé par /healthz et /readyz
+demarrage = Demarrage(
+    Composant("sheets", ouvrir_feuille, sur_pret=sheets_writer.definir_sheet),
+    Composant("vision", creer_client_vision),
+)
 
-        for j in range(i + 1, len(fragments)):
-            if used_fragment_indices[j]: # Ne devrait pas arriver si la logique est correcte
-                continue
+bot = Bot(TOKEN)
+# Envois Telegram en tâche de fond : débit limité par chat, confirmations regroupées en un
+# récapitulatif par fenêtre, avis d_erreur dédupliqués. Le limiteur est propre à chaque
+# process : avec JOB_WORKER_PROCESSES > 0, le débit par chat est partagé entre le bot et ses
+# process workers pour que le total reste sous TELEGRAM_MESSAGES_PAR_MINUTE (les pauses
+# RetryAfter, elles, ne sont connues que du process qui les a reçues).
+envoyeur = EnvoyeurTelegram(
+    bot,
+    fenetre_s=float(os.getenv("TELEGRAM_FENETRE_DIGEST_S", "3")),
+    messages_par_minute=float(os.getenv("TELEGRAM_MESSAGES_PAR_MINUTE", "20"))
+    / (1 + int(os.getenv("JOB_WORKER_PROCESSES", "0"))),
+    rafale=int(os.getenv("TELEGRAM_RAFALE", "3")),
+    dedup_erreurs_s=float(os.getenv("TELEGRAM_DEDUP_ERREURS_S", "300")),
+)
+# Photos déjà traitées (clé file_unique_id), persistées entre redémarrages
+dedup_index = DedupIndex(
+    os.getenv("DEDUP_DB_PATH", "data/dedup.sqlite3"),
+    taille_lru=int(os.getenv("DEDUP_LRU_TAILLE", "10000")),
+    ttl_s=float(os.getenv("DEDUP_TTL_JOURS", "30")) * 24 * 3600,
+)
 
-            last_ann_in_group = current_group_anns[-1]
-            next_ann = fragments[j]
-
-            y_diff = abs(last_ann_in_group["avg_y"] - next_ann["avg_y"])
-            x_diff_centers = next_ann["avg_x"] - last_ann_in_group["avg_x"]
-
-            Y_LINE_THRESHOLD = 20  
-            X_SPACE_THRESHOLD_MIN = 1 # Doit être à droite
-            X_SPACE_THRESHOLD_MAX = 85 # Augmenté pour plus de flexibilité
-
-            if y_diff < Y_LINE_THRESHOLD and X_SPACE_THRESHOLD_MIN < x_diff_centers < X_SPACE_THRESHOLD_MAX:
-                current_group_texts.append(next_ann["text"].strip())
-                current_group_anns.append(next_ann)
-                used_fragment_indices[j] = True # Marquer comme utilisé dans ce groupe
-            elif x_diff_centers >= X_SPACE_THRESHOLD_MAX or x_diff_centers <= 0: # Trop loin ou à gauche/superposé
-                # Remettre used_fragment_indices[j] à False s_il avait été mis à True par erreur ? Non, car on break.
-                break # Arrêter d_étendre ce groupe si le suivant est trop loin ou mal placé
-        
-        merged_text_with_spaces = " ".join(current_group_texts)
-        normalized_value = normaliser_nombre_followers(merged_text_with_spaces)
-
-        if normalized_value:
-            base_ann = current_group_anns[0]
-            merged_fragments_successfully.append({
-                "text": merged_text_with_spaces, 
-                "normalized": normalized_value,
-                "avg_y": base_ann["avg_y"],
-                "avg_x": base_ann["avg_x"],
-                "annotation": base_ann["annotation"]
-            })
-            logger.info(f"_fusionner_annotations_numeriques_adjacentes_instagram: Fusionné {current_group_texts} -> '{merged_text_with_spaces}' (normalisé: {normalized_value})")
-        else: # La fusion n_a pas donné un nombre valide, remettre les fragments originaux du groupe actuel
-            for k_idx, ann_in_failed_group in enumerate(current_group_anns):
-                 # Remettre l_index à False pour qu_il soit traité individuellement s_il n_était pas le premier du groupe
-                original_fragment_index_in_fragments_list = fragments.index(ann_in_failed_group) # Peut être coûteux
-                # Pour éviter la complexité de retrouver l_index, on les ajoute simplement
-                # s_ils sont normalisables seuls.
-                original_norm = normaliser_nombre_followers(ann_in_failed_group["text"])
-                if original_norm:
-                    merged_fragments_successfully.append({ 
-                        "text": ann_in_failed_group["text"],
-                        "normalized": original_norm,
-                        "avg_y": ann_in_failed_group["avg_y"],
-                        "avg_x": ann_in_failed_group["avg_x"],
-                        "annotation": ann_in_failed_group["annotation"]
-                    })
-                # Et marquer l_index comme non-utilisé pour qu_il puisse être repris s_il n_est pas le premier
-                if k_idx > 0 : # Si ce n_est pas le premier du groupe qui a échoué
-                    # Ceci est compliqué. Plus simple: si la fusion échoue, on ne fait rien ici, et les used_fragment_indices
-                    # pour les éléments après i (ceux de current_group_anns) seront toujours False s_ils n_ont pas été traités.
-                    # La logique actuelle est : si on commence un groupe avec fragments[i], on le marque used.
-                    # Si la fusion échoue, fragments[i] (et les autres du groupe) doivent être remis. C_est ce que fait la boucle externe.
-                    pass
-    
-    # Ajouter les fragments qui n_ont PAS été utilisés dans une fusion réussie
-    # (ceux pour lesquels used_fragment_indices est resté False ou ceux dont le groupe a échoué à la normalisation)
-    # C_est déjà un peu géré ci-dessus par la remise des fragments en cas d_échec de normalisation du groupe.
-    # Pour être sûr, on parcourt tous les fragments initiaux.
-    final_processed_fragments = []
-    temp_used_in_success = [False] * len(fragments)
-
-    for merged_ann in merged_fragments_successfully:
-        # Si merged_ann vient d_une fusion réelle (plus d_un texte original)
-        original_texts_in_merge = merged_ann["text"].split(" ")
-        if len(original_texts_in_merge) > 1 and merged_ann["text"] != merged_ann["annotation"].description.strip(): # Heuristique pour détecter une vraie fusion
-            # Trouver les fragments originaux correspondants et les marquer
-            # C_est trop complexe ici. On se fie à ce que merged_fragments_successfully contienne le bon set.
-            pass
-        final_processed_fragments.append(merged_ann)
-    
-    # Quels fragments n_ont pas été inclus dans `merged_fragments_successfully` ?
-    # On reconstruit la liste des fragments traités.
-    # `merged_fragments_successfully` contient soit des groupes fusionnés, soit des fragments individuels (si leur groupe a échoué à la normalisation).
-    # On doit s_assurer de ne pas avoir de doublons et que tous les fragments originaux y sont représentés une fois.
-
-    # Simplification: `merged_fragments_successfully` est la liste des fragments après tentative de fusion.
-    # Elle devrait contenir tous les éléments de `fragments`, soit fusionnés, soit tels quels.
-    # On la combine avec `others`.
-
-    final_number_annotations = merged_fragments_successfully + others
-    
-    if len(final_number_annotations) != len(number_annotations_list):
-        logger.info(f"_fusionner_annotations_numeriques_adjacentes_instagram: Taille de la liste modifiée. Avant: {len(number_annotations_list)}, Après: {len(final_number_annotations)}")
+# Étage OCR asynchrone : les appels Vision (bloquants) partent dans un pool de threads borné
+# pour que la boucle asyncio de python-telegram-bot reste réactive pendant l_OCR.
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "8"))
+# Nombre max de mises à jour traitées en parallèle par l_Application (au-delà, PTB n_en lit plus = backpressure)
+OCR_MAX_EN_ATTENTE = int(os.getenv("OCR_MAX_EN_ATTENTE", "32"))
+OCR_TIMEOUT_S = float(os.getenv("OCR_TIMEOUT_S", "30"))
+# Taille max d_une photo acceptée (0 = pas de limite)
+PHOTO_MAX_OCTETS = int(os.getenv("PHOTO_MAX_OCTETS", str(10 * 1024 * 1024)))
+# Prétraitement avant OCR (rotation EXIF, gris, réduction, recadrage optionnel sur l_en-tête)
+OCR_PRETRAITEMENT = os.getenv("OCR_PRETRAITEMENT", "1") == "1"
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "1600"))
+OCR_NIVEAUX_DE_GRIS = os.getenv("OCR_NIVEAUX_DE_GRIS", "1") == "1"
+OCR_RECADRAGE_ENTETE = os.getenv("OCR_RECADRAGE_ENTETE", "0") == "1"
+OCR_QUALITE_JPEG = int(os.getenv("OCR_QUALITE_JPEG", "85"))
+# Cache des résultats OCR, réutilisés seulement sur hash exact (le hash perceptuel ne sert qu_à repérer les reposts)
+ocr_cache = OcrCache(
+    taille_max=int(os.getenv("OCR_CACHE_TAILLE", "2000")),
+    ttl_s=float(os.getenv("OCR_CACHE_TTL_S", str(6 * 3600))),
+    distance_max=int(os.getenv("OCR_CACHE_DISTANCE_MAX", "0")),
+)
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix="ocr")
+ocr_semaphore = asyncio.Semaphore(OCR_MAX_WORKERS)
+# Niveau OCR local : Tesseract d_abord, Vision seulement si aucun handle connu ou si les
+# followers sont douteux. "auto" = activé si pytesseract et le binaire tesseract sont installés.
+OCR_TESSERACT = os.getenv("OCR_TESSERACT", "auto")
+# Confiance Tesseract minimale (0-100) du nombre de followers pour garder le résultat sans Vision
+TESSERACT_CONFIANCE_FOLLOWERS = float(os.getenv("TESSERACT_CONFIANCE_FOLLOWERS", "85"))
+ocr_tesseract = None
+if OCR_TESSERACT == "1" or (OCR_TESSERACT == "auto" and tesseract_disponible()):
+    if tesseract_disponible():
+        ocr_tesseract = OcrTesseract(
+            max_workers=int(os.getenv("TESSERACT_WORKERS", "0")) or None,
+            langues=os.getenv("TESSERACT_LANGUES", "fra+eng"),
+            config=os.getenv("TESSERACT_CONFIG", "--oem 1 --psm 11"),
+            confiance_min=float(os.getenv("TESSERACT_CONFIANCE_MIN", "60")),
+            timeout_s=float(os.getenv("TESSERACT_TIMEOUT_S", "20")),
+        )
+        logger.info("Niveau OCR Tesseract activé (escalade vers Vision si nécessaire).")
     else:
-        logger.info("_fusionner_annotations_numeriques_adjacentes_instagram: Taille de la liste inchangée après tentative de fusion.")
-
-    return final_number_annotations
-
-def extraire_followers_spatial(text_annotations, mots_cles_specifiques, reseau_nom="inconnu") -> str | None:
+        logger.warning("OCR_TESSERACT=1 mais pytesseract / tesseract introuvable : OCR par Vision uniquement.")
+
+# File de jobs durable entre la réception Telegram et les workers OCR / Sheets.
+# Les workers réclament un album entier (ou une rafale du même chat) : un appel Vision,
+# un lot Sheets et un message par lot. Un job n_est réclamé qu_après la fenêtre d_attente.
+ALBUM_FENETRE_S = float(os.getenv("ALBUM_FENETRE_S", "1.5"))
+CHAT_FENETRE_S = float(os.getenv("CHAT_FENETRE_S", "0.5"))
+# batch_annotate_images accepte au plus 16 images par requête
+JOB_LOT_TAILLE = min(16, int(os.getenv("ALBUM_TAILLE_MAX", "16")))
+JOB_VISIBILITE_S = float(os.getenv("JOB_VISIBILITE_S", "180"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "0.25"))
+# Consommateurs asyncio par process, et process workers lancés en plus du bot
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "0"))
+file_jobs = ouvrir_file(
+    os.getenv("JOB_QUEUE_URL", "sqlite:///data/jobs.sqlite3"),
+    max_tentatives=int(os.getenv("JOB_MAX_TENTATIVES", "5")),
+)
+arret_workers = asyncio.Event()
+taches_workers = []
+taches_fond = []  # tâches annulées à l_arrêt (sans fin de travail à attendre)
+processus_workers = []
+
+# Si défini, chaque réponse Vision est enregistrée en fixture JSON dans ce dossier
+OCR_FIXTURES_DIR = os.getenv("OCR_FIXTURES_DIR")
+# Handles connus compilés en un seul automate, rechargé à chaud si known_handles.json change
+handle_matcher = HandleMatcher(os.getenv("KNOWN_HANDLES_PATH", "known_handles.json"))
+
+# Historique local des relevés (SQLite) : /stats et /top, contrôle de plausibilité avant écriture
+historique = HistoriqueFollowers(
+    os.getenv("HISTORIQUE_DB_PATH", "data/historique.sqlite3"),
+    variation_max=float(os.getenv("HISTORIQUE_VARIATION_MAX", "0.5")),
+    variation_min_abs=int(os.getenv("HISTORIQUE_VARIATION_MIN_ABS", "100")),
+)
+HISTORIQUE_IMPORT_SHEET = os.getenv("HISTORIQUE_IMPORT_SHEET", "1") == "1"
+
+# Métriques : résumé périodique dans les logs (0 = désactivé) et profilage cProfile d_une
+# fraction des extractions (PROFILE_SAMPLE_RATE=0.01 -> 1 image sur 100)
+METRIQUES_RESUME_INTERVALLE_S = float(os.getenv("METRIQUES_RESUME_INTERVALLE_S", "300"))
+identifier_profile = profil_echantillonne(float(os.getenv("PROFILE_SAMPLE_RATE", "0")))(identifier_reseau_et_username_par_ocr)
+REGISTRE.jauge("bot_file_jobs_profondeur", "Jobs en attente ou en cours dans la file", file_jobs.profondeur)
+REGISTRE.jauge("bot_file_jobs_dead_letters", "Jobs en dead letter", file_jobs.nb_dead_letters)
+REGISTRE.jauge("bot_sheets_spool_en_attente", "Lignes du spool Sheets pas encore écrites", sheets_writer.en_attente)
+REGISTRE.jauge("bot_sheets_spool_en_erreur", "Lignes du spool Sheets mises de côté après une erreur définitive", sheets_writer.en_erreur)
+
+async def detecter_textes_lot(contenus: list) -> list:
+    """Un seul appel Vision batch_annotate_images (TEXT_DETECTION) pour tout le lot, dans le pool OCR.
+
+    Retourne une AnnotateImageResponse par image, dans le même ordre.
+    """
+    from google.cloud import vision
+    vision_client = demarrage["vision"].valeur
+    requetes = [
+        vision.AnnotateImageRequest(
+            image=vision.Image(content=contenu),
+            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+        )
+        for contenu in contenus
+    ]
+    async with ocr_semaphore:
+        loop = asyncio.get_running_loop()
+        with DUREE_ETAPE.chronometrer(etape="vision"):
+            reponse = await loop.run_in_executor(
+                ocr_executor, lambda: vision_client.batch_annotate_images(requests=requetes, timeout=OCR_TIMEOUT_S)
+            )
+    return list(reponse.responses)
+
+def calculer_hashs_image(content: bytes):
     try:
-        logger.info(f"extraire_followers_spatial ({reseau_nom}): --- Début de l_extraction spatiale ---")
-        keyword_annotations_list = []
-        number_annotations_list = []
-
-        if not text_annotations:
-            logger.warning(f"extraire_followers_spatial ({reseau_nom}): Aucune annotation de texte fournie.")
-            return None
-        
-        logger.info(f"extraire_followers_spatial ({reseau_nom}): Nombre total d_annotations reçues: {len(text_annotations)}")
-        # ... (logging des premières annotations)
+        phash = hash_perceptuel(content)
+    except Exception as e:
+        logger.warning(f"Hash perceptuel impossible ({e}), cache OCR limité au hash exact.")
+        phash = None
+    return hash_contenu(content), phash
 
-        for i, annotation in enumerate(text_annotations[1:]):
-            try:
-                if not hasattr(annotation, 'description') or not hasattr(annotation, 'bounding_poly'):
-                    continue
-                text = annotation.description.lower().strip()
-                if not hasattr(annotation.bounding_poly, 'vertices') or len(annotation.bounding_poly.vertices) < 4:
-                    continue
-                vertices = annotation.bounding_poly.vertices
-                avg_y = (vertices[0].y + vertices[1].y + vertices[2].y + vertices[3].y) / 4
-                avg_x = (vertices[0].x + vertices[1].x + vertices[2].x + vertices[3].x) / 4
-
-                if any(keyword.lower() in text for keyword in mots_cles_specifiques):
-                    keyword_annotations_list.append({"text": text, "avg_y": avg_y, "avg_x": avg_x, "annotation": annotation})
-                
-                # Regex pour identifier les nombres potentiels (y compris avec k/m, espaces, points, virgules)
-                # Exclut les formats d_heure simples comme "10:30"
-                if re.search(r"\d", text) and re.match(r"^[\d.,\s]*[kKmMsS]?$", text, re.IGNORECASE) and not re.fullmatch(r"\d{1,2}:\d{2}[\s\w]*", text, re.IGNORECASE):
-                    nombre_normalise_test = normaliser_nombre_followers(text)
-                    if nombre_normalise_test:
-                        number_annotations_list.append({"text": text, "normalized": nombre_normalise_test, "avg_y": avg_y, "avg_x": avg_x, "annotation": annotation})
-            except Exception as e_loop_ann:
-                logger.error(f"extraire_followers_spatial ({reseau_nom}): ERREUR INATTENDUE lors du traitement de l_annotation {i}: {e_loop_ann}")
-                continue 
-
-        logger.info(f"extraire_followers_spatial ({reseau_nom}): Fin de la boucle d_analyse des annotations.")
-        logger.info(f"extraire_followers_spatial ({reseau_nom}): Nombre de mots-clés trouvés: {len(keyword_annotations_list)}")
-        logger.info(f"extraire_followers_spatial ({reseau_nom}): Nombre de nombres potentiels trouvés AVANT fusion: {len(number_annotations_list)}")
-
-        if reseau_nom == "instagram":
-            number_annotations_list = _fusionner_annotations_numeriques_adjacentes_instagram(number_annotations_list, reseau_nom)
-            logger.info(f"extraire_followers_spatial ({reseau_nom}): Nombre de nombres potentiels trouvés APRES fusion: {len(number_annotations_list)}")
-
-        for idx, na in enumerate(number_annotations_list):
-            logger.info(f"  - Nombre {idx} (post-fusion): {na['text']} (normalisé: {na['normalized']}) à y={na['avg_y']}")
-
-        if not keyword_annotations_list:
-            logger.warning(f"extraire_followers_spatial ({reseau_nom}): Aucun mot-clé de followers trouvé. Tentative de fallback.")
-            if len(number_annotations_list) >= 3:
-                number_annotations_list.sort(key=lambda ann: ann['avg_x'])
-                if (abs(number_annotations_list[0]['avg_y'] - number_annotations_list[1]['avg_y']) < 30 and 
-                    abs(number_annotations_list[1]['avg_y'] - number_annotations_list[2]['avg_y']) < 30):
-                    return number_annotations_list[1]['normalized']
+def preparer_image_ocr(content: bytes, facteur_reference: float):
+    try:
+        contenu_ocr, echelle = pretraiter_image(
+            content,
+            max_dimension=OCR_MAX_DIMENSION,
+            niveaux_de_gris=OCR_NIVEAUX_DE_GRIS,
+            recadrage_entete=OCR_RECADRAGE_ENTETE,
+            qualite_jpeg=OCR_QUALITE_JPEG,
+            facteur_reference=facteur_reference,
+        )
+        logger.info(f"Prétraitement OCR: {len(content)} -> {len(contenu_ocr)} octets (échelle {echelle:.3f})")
+        return contenu_ocr, echelle
+    except Exception as e:
+        logger.warning(f"Prétraitement impossible ({e}), image envoyée telle quelle.")
+        return content, 1.0 / facteur_reference
+
+async def preparer_job(job: dict) -> dict | None:
+    """Étapes par photo avant l_OCR : téléchargement, cache, prétraitement."""
+    # Chaque préparation tourne dans sa propre tâche (gather) : le contexte ne déborde pas
+    with contexte_image(job["file_unique_id"]):
+        element = {"job": job, "file_id": job["file_id"], "file_unique_id": job["file_unique_id"], "username_posteur": job["username"]}
+        photos = job["photos"]
+        # Variante la plus légère suffisante pour l_OCR ; les coordonnées restent exprimées
+        # dans le repère de la plus grande (facteur_reference)
+        photo_ocr = choisir_taille_photo(photos, OCR_MAX_DIMENSION) if OCR_PRETRAITEMENT else photos[-1]
+        facteur_reference = photos[-1]["width"] / photo_ocr["width"] if photo_ocr["width"] else 1.0
+
+        # Refus précoce des fichiers trop gros (avant même get_file)
+        taille_annoncee = photo_ocr["file_size"]
+        if PHOTO_MAX_OCTETS and taille_annoncee and taille_annoncee > PHOTO_MAX_OCTETS:
+            logger.warning(f"Image {job['file_id']} ignorée: {taille_annoncee} octets > limite {PHOTO_MAX_OCTETS}.")
             return None
 
-        best_candidate = None
-        min_distance = float('inf')
-
-        for kw_ann in keyword_annotations_list:
-            for num_ann in number_annotations_list:
-                y_diff = num_ann['avg_y'] - kw_ann['avg_y'] 
-                x_diff = abs(kw_ann['avg_x'] - num_ann['avg_x'])
-                if y_diff > -25 and y_diff < 100 and x_diff < 150: 
-                    distance = (y_diff**2 + x_diff**2)**0.5
-                    if distance < min_distance:
-                        try:
-                            min_distance = distance
-                            best_candidate = num_ann['normalized']
-                        except ValueError:
-                            pass # Ignorer si la normalisation a échoué plus tôt
-        
-        if best_candidate:
-            return best_candidate
-        else:
-            logger.warning(f"extraire_followers_spatial ({reseau_nom}): Aucun candidat sélectionné. Fallback sur le plus grand nombre.")
-            if number_annotations_list:
-                number_annotations_list.sort(key=lambda x: int(x.get("normalized", "0") or "0"), reverse=True)
-                if number_annotations_list and number_annotations_list[0]['normalized']:
-                     return number_annotations_list[0]['normalized']
+        with DUREE_ETAPE.chronometrer(etape="get_file"):
+            new_file = await bot.get_file(photo_ocr["file_id"])
+        if PHOTO_MAX_OCTETS and new_file.file_size and new_file.file_size > PHOTO_MAX_OCTETS:
+            logger.warning(f"Image {job['file_id']} ignorée: {new_file.file_size} octets > limite {PHOTO_MAX_OCTETS}.")
             return None
-
-    except Exception as e_global_spatial:
-        logger.error(f"extraire_followers_spatial ({reseau_nom}): ERREUR GLOBALE INATTENDUE: {e_global_spatial}")
-        logger.error(traceback.format_exc())
-        return None
-
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Téléchargement en mémoire : pas de fichier temporaire, le buffer part directement à l_OCR
+        # (getvalue() d_un BytesIO non modifié ensuite ne recopie pas les données)
+        buffer = io.BytesIO()
+        with DUREE_ETAPE.chronometrer(etape="telechargement"):
+            await new_file.download_to_memory(out=buffer)
+        content = buffer.getvalue()
+        logger.info(f"Photo téléchargée en mémoire ({len(content)} octets)")
+
+        element["sha256"], element["phash"] = await asyncio.to_thread(calculer_hashs_image, content)
+        entree_cache = ocr_cache.chercher(element["sha256"], element["phash"])
+        OCR_CACHE.inc(resultat="miss" if entree_cache is None else "hit_proche" if entree_cache.get("proche") else "hit_exact")
+        if entree_cache is not None and entree_cache.get("proche"):
+            # Même mise en page ne veut pas dire même compte ni même compteur : on refait l_OCR
+            logger.info(f"Quasi-doublon d_une capture déjà lue ({entree_cache['resultat'][1]}), OCR refait.")
+        elif entree_cache is not None:
+            element["resultat"] = entree_cache["resultat"]
+            element["niveau"] = "cache"
+            OCR_NIVEAU.inc(niveau="cache")
+            logger.info(f"Résultat OCR repris du cache: {entree_cache['resultat']} (stats: {ocr_cache.stats()})")
+            return element
+
+        element["contenu_ocr"], element["echelle"] = content, 1.0 / facteur_reference
+        if OCR_PRETRAITEMENT:
+            with DUREE_ETAPE.chronometrer(etape="pretraitement"):
+                element["contenu_ocr"], element["echelle"] = await asyncio.to_thread(preparer_image_ocr, content, facteur_reference)
+        return element
+
+async def resoudre_par_tesseract(elements: list) -> list:
+    """OCR local des éléments ; retourne ceux à escalader vers Vision.
+
+    Le résultat Tesseract n_est gardé que si un handle connu est reconnu et que les
+    followers ont été lus à côté du mot-clé followers, avec une confiance Tesseract d_au
+    moins TESSERACT_CONFIANCE_FOLLOWERS : sinon Vision (plus fiable) refait l_image.
+    """
     try:
-        user = update.message.from_user
-        file_id = update.message.photo[-1].file_id
-        logger.info(f"Photo reçue de {user.username} (ID: {user.id}), file_id: {file_id}")
-
-        if file_id in already_processed:
-            logger.info(f"Image {file_id} déjà traitée. Ignorée.")
-            # await update.message.reply_text("Cette image a déjà été traitée.") # Optionnel
-            return
-        
-        new_file = await context.bot.get_file(file_id)
-        file_path = await new_file.download_to_drive()
-        logger.info(f"Photo téléchargée: {file_path}")
-
-        with io.open(file_path, 'rb') as image_file:
-            content = image_file.read()
-        image = vision.Image(content=content)
-        response = vision_client.text_detection(image=image)
-        texts = response.text_annotations
-
-        if response.error.message:
-            raise Exception(f"Erreur de l_API Vision: {response.error.message}")
-
-        if not texts:
-            logger.warning("Aucun texte détecté dans l_image.")
-            await update.message.reply_text("Aucun texte n_a été détecté dans l_image.")
-            return
+        with DUREE_ETAPE.chronometrer(etape="tesseract"):
+            resultats = await ocr_tesseract.detecter_lot([el["contenu_ocr"] for el in elements])
+    except Exception as e:
+        logger.warning(f"Tesseract indisponible pour ce lot ({e!r}), escalade vers Vision.")
+        resultats = [None] * len(elements)
+    a_escalader = []
+    for el, texts in zip(elements, resultats):
+        with contexte_image(el["file_unique_id"]):
+            if not texts:
+                OCR_ESCALADES.inc(raison="erreur" if texts is None else "sans_texte")
+                a_escalader.append(el)
+                continue
+            if el["echelle"] != 1.0:
+                texts = reprojeter_annotations(texts, el["echelle"])
+            details = {}
+            with DUREE_ETAPE.chronometrer(etape="identification"):
+                resultat = identifier_profile(texts, handle_matcher, details)
+            # Même passe que l_identification : pas de second balayage du texte par handle_matcher
+            if details.get("identification") != "known_handles":
+                OCR_ESCALADES.inc(raison="handle_inconnu")
+                a_escalader.append(el)
+            elif not resultat[2]:
+                OCR_ESCALADES.inc(raison="sans_followers")
+                a_escalader.append(el)
+            elif details.get("source") != "mots_cles":
+                # Nombre choisi par une heuristique de secours, pas à côté du mot-clé followers
+                OCR_ESCALADES.inc(raison="followers_repli")
+                a_escalader.append(el)
+            elif details.get("confiance") is None or details["confiance"] < TESSERACT_CONFIANCE_FOLLOWERS:
+                OCR_ESCALADES.inc(raison="confiance_followers")
+                a_escalader.append(el)
+            else:
+                el["resultat"], el["niveau"] = resultat, "tesseract"
+                OCR_NIVEAU.inc(niveau="tesseract")
+                # Pas de fixture : les fixtures du benchmark sont des réponses Vision
+                ocr_cache.stocker(el["sha256"], el["phash"], annotations_vers_dicts(texts), resultat)
+    if a_escalader:
+        logger.info(f"Tesseract: {len(elements) - len(a_escalader)}/{len(elements)} image(s) résolue(s), {len(a_escalader)} escaladée(s) vers Vision.")
+    return a_escalader
+
+def journaliser_image(el: dict, reseau=None, username=None, followers=None):
+    """Un record par image, avec ses champs sous "image" (visibles en LOG_FORMAT=json)."""
+    job = el["job"]
+    with contexte_image(el["file_unique_id"]):
+        logger.info(
+            f"Image traitée ({el.get('niveau', 'aucun texte')}): réseau={reseau}, utilisateur={username}, followers={followers}",
+            extra={"image": {
+                "file_unique_id": el["file_unique_id"],
+                "chat_id": job["chat_id"],
+                "media_group_id": job.get("media_group_id"),
+                "niveau_ocr": el.get("niveau"),
+                "reseau": reseau,
+                "username": username,
+                "followers": followers,
+                "tentative": job.get("_tentatives"),
+                "delai_s": round(datetime.datetime.now().timestamp() - job["recu_le"], 3) if job.get("recu_le") else None,
+            }},
+        )
+
+async def traiter_lot(elements: list):
+    """OCR groupé du lot, extraction par image, un seul lot Sheets ; confirmations regroupées par l_envoyeur.
+
+    Les éléments en échec reçoivent une clé "erreur" (le job sera retenté) et ne sont pas annoncés.
+    """
+    a_ocr = [el for el in elements if "resultat" not in el]
+    if a_ocr and ocr_tesseract is not None:
+        a_ocr = await resoudre_par_tesseract(a_ocr)
+    if a_ocr:
+        try:
+            reponses = await detecter_textes_lot([el["contenu_ocr"] for el in a_ocr])
+        except Exception as e:
+            ECHECS_OCR.inc(len(a_ocr), raison="appel_vision")
+            for el in a_ocr:
+                el["erreur"] = e
+            reponses = []
+        for el, response in zip(a_ocr, reponses):
+            with contexte_image(el["file_unique_id"]):
+                try:
+                    if response.error.message:
+                        ECHECS_OCR.inc(raison="erreur_vision")
+                        raise Exception(f"Erreur de l_API Vision: {response.error.message}")
+                    texts = response.text_annotations
+                    if not texts:
+                        logger.warning("Aucun texte détecté dans l_image.")
+                        ECHECS_OCR.inc(raison="sans_texte")
+                        el["sans_texte"] = True
+                        continue
+                    if el["echelle"] != 1.0:
+                        texts = reprojeter_annotations(texts, el["echelle"])
+                    with DUREE_ETAPE.chronometrer(etape="identification"):
+                        el["resultat"] = identifier_profile(texts, handle_matcher)
+                    el["niveau"] = "vision"
+                    OCR_NIVEAU.inc(niveau="vision")
+                    ocr_cache.stocker(el["sha256"], el["phash"], annotations_vers_dicts(texts), el["resultat"])
+                    if OCR_FIXTURES_DIR:
+                        # Enregistrement de la réponse Vision pour le benchmark hors ligne (bench_ocr.py)
+                        await asyncio.to_thread(enregistrer_fixture, OCR_FIXTURES_DIR, el["sha256"], texts, el["resultat"])
+                except Exception as e:
+                    el["erreur"] = e
+
+    maintenant = datetime.datetime.now()
+    reussis = [el for el in elements if "erreur" not in el]
+    lignes_sheet = []
+    lignes_message = []
+    indices_message = []  # ligne de message correspondant à chaque ligne Sheets
+    for el in reussis:
+        IMAGES_TRAITEES.inc()
+        if el.get("sans_texte"):
+            journaliser_image(el)
+            if len(elements) == 1:
+                envoyeur.envoyer(el["job"]["chat_id"], "Aucun texte n_a été détecté dans l_image.", reply_to_message_id=el["job"]["message_id"])
+            else:
+                lignes_message.append("❓ Aucun texte détecté dans l_image")
+            continue
 
-        reseau_nom, username, followers = identifier_reseau_et_username_par_ocr(texts, KNOWN_HANDLES)
-        
+        reseau_nom, username, followers = el["resultat"]
         if username:
             username = corriger_username(username, reseau_nom.lower() if reseau_nom else "inconnu")
-            logger.info(f"Réseau identifié: {reseau_nom}, Utilisateur: {username}, Followers: {followers}")
-            
-            # Message de confirmation dans le groupe Telegram
-            message_confirmation = f"🤖 {datetime.datetime.now().strftime('%d/%m/%Y')} - {username.upper()} - "
+        journaliser_image(el, reseau_nom, username, followers)
+        if username:
             if followers:
-                message_confirmation += f"{followers} followers"
-                # Écrire dans Google Sheets
-                try:
-                    row = [datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), username, followers, reseau_nom, user.username, file_id]
-                    sheet.append_row(row)
-                    logger.info(f"Données écrites dans Google Sheets pour {username}")
-                except Exception as e_gsheet:
-                    logger.error(f"Erreur lors de l_écriture dans Google Sheets: {e_gsheet}")
-                    logger.error(traceback.format_exc())
-                    await bot.send_message(GROUP_ID, text=f"⚠️ Erreur lors de l_écriture GSheet pour {username}: {e_gsheet}")
+                indices_message.append(len(lignes_message))
+                lignes_message.append(f"{username.upper()} - {followers} followers")
+                lignes_sheet.append([maintenant.strftime("%Y-%m-%d %H:%M:%S"), username, followers, reseau_nom, el["username_posteur"], el["file_id"]])
             else:
-                message_confirmation += "❌ Analyse OCR followers impossible ❌"
-            
-            await bot.send_message(GROUP_ID, text=message_confirmation)
-            already_processed.add(file_id) # Ajouter après traitement réussi
+                lignes_message.append(f"{username.upper()} - ❌ Analyse OCR followers impossible ❌")
         else:
             logger.warning("Impossible d_identifier le réseau ou l_utilisateur.")
-            await bot.send_message(GROUP_ID, text=f"🤖 {datetime.datetime.now().strftime('%d/%m/%Y')} - ❓ Compte inconnu - ❌ Analyse OCR impossible (réseau/user non identifié) ❌")
-            already_processed.add(file_id) # Ajouter même si échec pour éviter re-traitement
+            COMPTES_INCONNUS.inc()
+            lignes_message.append("❓ Compte inconnu - ❌ Analyse OCR impossible (réseau/user non identifié) ❌")
+
+    # Historique local, avec contrôle des sauts improbables par rapport au dernier relevé
+    if lignes_sheet:
+        try:
+            alertes = await asyncio.to_thread(historique.enregistrer, lignes_sheet)
+            for indice, alerte in zip(indices_message, alertes):
+                if alerte:
+                    logger.warning(f"Relevé suspect: {lignes_message[indice]} ({alerte})")
+                    lignes_message[indice] += f" ⚠️ {alerte}"
+        except Exception as e:
+            logger.error(f"Écriture dans l_historique local impossible: {e}")
+
+    # Écrire dans Google Sheets (un seul lot pour tout l_album)
+    if lignes_sheet:
+        try:
+            with DUREE_ETAPE.chronometrer(etape="sheets_spool"):
+                await sheets_writer.ajouter_lignes(lignes_sheet)
+            sheets_writer.demander_flush()
+            logger.info(f"{len(lignes_sheet)} ligne(s) mises en file pour Google Sheets")
+        except Exception as e_gsheet:
+            ERREURS_SHEETS.inc(type="spool")
+            logger.error(f"Erreur lors de l_écriture dans Google Sheets: {e_gsheet}")
+            logger.error(traceback.format_exc())
+            envoyeur.signaler_erreur(GROUP_ID, f"⚠️ Erreur lors de l_écriture GSheet pour {len(lignes_sheet)} ligne(s): {e_gsheet}")
+
+    # Confirmations dans le groupe Telegram : un récapitulatif par fenêtre, tous lots confondus
+    for ligne in lignes_message:
+        envoyeur.confirmer(GROUP_ID, ligne)
+
+async def signaler_job_mort(job: dict, erreur: str):
+    # Abandon définitif : la photo pourra être retraitée si elle est renvoyée
+    JOBS_DEAD_LETTER.inc()
+    dedup_index.liberer(job["file_unique_id"])
+    envoyeur.signaler_erreur(GROUP_ID, f"🤖 Erreur critique dans le bot: {erreur}. Consultez les logs.")
+
+async def echouer_job(job: dict, erreur: Exception):
+    logger.error(f"Erreur lors du traitement de {job['file_unique_id']} (tentative {job['_tentatives']}): {erreur}")
+    mort = await asyncio.to_thread(file_jobs.echouer, job, str(erreur))
+    if mort is not None:
+        await signaler_job_mort(mort, str(erreur))
+
+async def traiter_jobs(jobs: list):
+    preparations = await asyncio.gather(*(preparer_job(job) for job in jobs), return_exceptions=True)
+    elements = []
+    for job, preparation in zip(jobs, preparations):
+        if isinstance(preparation, Exception):
+            await echouer_job(job, preparation)
+        elif preparation is None:
+            await asyncio.to_thread(file_jobs.terminer, job)
+        else:
+            elements.append(preparation)
+    if not elements:
+        return
+    try:
+        await traiter_lot(elements)
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        for el in elements:
+            el.setdefault("erreur", e)
+    for el in elements:
+        if "erreur" in el:
+            await echouer_job(el["job"], el["erreur"])
+        else:
+            await asyncio.to_thread(file_jobs.terminer, el["job"])
+
+async def boucle_worker(nom: str, arret: asyncio.Event):
+    logger.info(f"{nom}: démarré.")
+    # Photos reçues avant que Vision soit prêt : elles attendent dans la file durable
+    if not demarrage["vision"].pret:
+        logger.info(f"{nom}: en attente du client Vision.")
+        while not arret.is_set() and not demarrage["vision"].pret:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(arret.wait(), timeout=JOB_POLL_S)
+    while not arret.is_set():
+        try:
+            jobs, morts = await asyncio.to_thread(
+                file_jobs.reclamer_lot, JOB_LOT_TAILLE, JOB_VISIBILITE_S, ALBUM_FENETRE_S, CHAT_FENETRE_S
+            )
+            for mort in morts:
+                await signaler_job_mort(mort, "traitement interrompu trop de fois")
+            if not jobs:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(arret.wait(), timeout=JOB_POLL_S)
+                continue
+            logger.info(f"{nom}: lot de {len(jobs)} job(s) réclamé.")
+            await traiter_jobs(jobs)
+        except Exception as e:
+            logger.error(f"{nom}: erreur inattendue: {e}")
+            logger.error(traceback.format_exc())
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(arret.wait(), timeout=5)
+    logger.info(f"{nom}: arrêté.")
+
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Réception : dédup puis mise en file. L_OCR et l_écriture se font dans les workers."""
+    try:
+        message = update.message
+        user = message.from_user
+        file_id = message.photo[-1].file_id
+        file_unique_id = message.photo[-1].file_unique_id
+        with contexte_image(file_unique_id):
+            logger.info(f"Photo reçue de {user.username} (ID: {user.id}), file_id: {file_id}")
+
+            # Vérification + réservation avant tout téléchargement ou appel Vision
+            if not dedup_index.reserver(file_unique_id):
+                logger.info(f"Image {file_unique_id} déjà traitée. Ignorée.")
+                DEDUP_HITS.inc()
+                # await update.message.reply_text("Cette image a déjà été traitée.") # Optionnel
+                return
+
+            job = {
+                "file_unique_id": file_unique_id,
+                "file_id": file_id,
+                "chat_id": message.chat_id,
+                "message_id": message.message_id,
+                "media_group_id": message.media_group_id,
+                "user_id": user.id,
+                "username": user.username,
+                "recu_le": message.date.timestamp() if message.date else None,
+                "photos": [
+                    {"file_id": p.file_id, "width": p.width, "height": p.height, "file_size": p.file_size}
+                    for p in message.photo
+                ],
+            }
+            try:
+                await asyncio.to_thread(file_jobs.ajouter, job)
+            except Exception:
+                dedup_index.liberer(file_unique_id)
+                raise
 
     except Exception as e:
         logger.error(f"Erreur dans handle_photo: {e}")
         logger.error(traceback.format_exc())
-        await bot.send_message(GROUP_ID, text=f"🤖 Erreur critique dans le bot: {e}. Consultez les logs.")
-    finally:
-        if 'file_path' in locals() and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                logger.info(f"Fichier temporaire {file_path} supprimé.")
-            except OSError as e_remove:
-                logger.error(f"Erreur lors de la suppression du fichier temporaire {file_path}: {e_remove}")
-
-def identifier_reseau_et_username_par_ocr(text_annotations, known_handles):
-    full_text_ocr = text_annotations[0].description.lower() if text_annotations else ""
-    logger.info(f"Texte OCR complet pour identification: {full_text_ocr[:500]}...")
-
-    # Identification du réseau et de l_username
-    reseau_nom = "Inconnu"
-    username_ocr = None
-    followers = None
-
-    # Keywords pour chaque réseau
-    mots_cles = {
-        "instagram": ["profil", "publications", "followers", "suivi(e)s", "modifier profil", "voir les traductions"],
-        "twitter": ["profil", "abonnements", "abonnés", "tweets", "éditer le profil"],
-        "threads": ["profil", "followers", "threads", "réponses", "republications"],
-        "tiktok": ["profil", "abonnements", "followers", "j_aime", "modifier le profil", "partager le profil"]
-    }
-    mots_cles_followers_specifiques = {
-        "instagram": ["followers", "abonnés"], # Le nombre est au-dessus
-        "twitter": ["abonnés", "followers"],    # Le nombre est à gauche
-        "threads": ["followers"],            # Le nombre est à gauche
-        "tiktok": ["followers", "abonnés"]     # Le nombre est au-dessus
-    }
-
-    # 1. Essayer d_identifier le réseau via les known_handles (plus fiable)
-    for handle_type, handles_list in known_handles.items():
-        for handle_info in handles_list:
-            handle = handle_info["id"]
-            # Vérifier si le handle (avec ou sans @) est dans le texte OCR
-            if f"@{handle.lower()}" in full_text_ocr or handle.lower() in full_text_ocr:
-                reseau_nom = handle_info.get("reseau", handle_type.capitalize())
-                username_ocr = handle
-                logger.info(f"Correspondance trouvée via known_handles: Réseau='{reseau_nom}', User='{username_ocr}'")
-                break
-        if username_ocr:
-            break
-    
-    # 2. Si non trouvé par known_handles, essayer par mots-clés génériques du réseau
-    if not username_ocr:
-        logger.info("Aucune correspondance via known_handles. Tentative par mots-clés génériques.")
-        best_match_reseau = None
-        max_keyword_count = 0
-        for net, keywords in mots_cles.items():
-            count = sum(1 for kw in keywords if kw in full_text_ocr)
-            if count > max_keyword_count:
-                max_keyword_count = count
-                best_match_reseau = net
-        
-        if best_match_reseau and max_keyword_count > 1: # Nécessite au moins 2 mots-clés pour réduire les faux positifs
-            reseau_nom = best_match_reseau.capitalize()
-            logger.info(f"Réseau identifié par mots-clés génériques: '{reseau_nom}' (count: {max_keyword_count})")
-            # Essayer d_extraire un @username si possible pour ce réseau
-            match_username = re.search(r"@([a-zA-Z0-9_.]+)", full_text_ocr)
-            if match_username:
-                username_ocr = match_username.group(1)
-                logger.info(f"Username extrait par regex après identification réseau: '{username_ocr}'")
-            else: # Si pas de @username, chercher un nom probable près des mots-clés (plus complexe, pour plus tard)
-                logger.warning(f"Réseau '{reseau_nom}' identifié, mais pas de @username trouvé par regex.")
-        else:
-            logger.warning("Identification du réseau par mots-clés génériques incertaine ou échouée.")
+        envoyeur.signaler_erreur(GROUP_ID, f"🤖 Erreur critique dans le bot: {e}. Consultez les logs.")
 
-    # 3. Extraction des followers si réseau identifié (même si username pas parfait)
-    if reseau_nom != "Inconnu":
-        current_mots_cles_followers = mots_cles_followers_specifiques.get(reseau_nom.lower(), [])
-        if not current_mots_cles_followers:
-            logger.warning(f"Pas de mots-clés followers spécifiques pour le réseau {reseau_nom}")
-        else:
-            logger.info(f"Utilisation des mots-clés followers pour {reseau_nom}: {current_mots_cles_followers}")
-            followers = extraire_followers_spatial(text_annotations, current_mots_cles_followers, reseau_nom.lower())
-            if followers:
-                logger.info(f"Followers extraits pour {reseau_nom}: {followers}")
-            else:
-                logger.warning(f"Échec de l_extraction des followers pour {reseau_nom} avec la méthode spatiale.")
-    else:
-        logger.warning("Réseau non identifié, impossible d_extraire les followers.")
+def formater_nombre(n: int) -> str:
+    return f"{n:,}".replace(",", " ")
 
-    # Si username_ocr n_est toujours pas trouvé mais réseau oui, on peut tenter un fallback plus tard
-    if not username_ocr and reseau_nom != "Inconnu":
-        logger.warning(f"Réseau {reseau_nom} identifié, mais username_ocr est None. OCR complet utilisé comme fallback pour nom de compte.")
-        # On pourrait essayer de prendre le premier mot proéminent comme username, mais risqué.
-        # Pour l_instant, on ne met rien si pas de @user ou de known_handle.
+def formater_variation(variation: int, pct) -> str:
+    texte = f"{'+' if variation >= 0 else '-'}{formater_nombre(abs(variation))}"
+    return f"{texte} ({pct:+.1%})" if pct is not None else texte
 
-    return reseau_nom, username_ocr, followers
+def lire_jours(args: list, position: int, defaut: float = 7) -> float:
+    try:
+        return max(0.1, float(args[position]))
+    except (IndexError, ValueError):
+        return defaut
+
+async def commande_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats <handle> [jours] : évolution d_un compte, depuis l_historique local."""
+    message = update.effective_message
+    if not context.args:
+        envoyeur.envoyer(message.chat_id, "Usage : /stats <handle> [jours]", reply_to_message_id=message.message_id)
+        return
+    jours = lire_jours(context.args, 1)
+    resultats = await asyncio.to_thread(historique.stats, context.args[0], jours)
+    if not resultats:
+        texte = f"Aucun relevé pour @{context.args[0].lstrip('@')}."
+    else:
+        blocs = []
+        for r in resultats:
+            date = datetime.datetime.fromtimestamp(r["dernier_ts"]).strftime("%d/%m/%Y %H:%M")
+            blocs.append(
+                f"📈 @{r['username']} ({r['reseau']})\n"
+                f"Dernier relevé : {formater_nombre(r['followers'])} followers ({date})\n"
+                f"{jours:g} j : {formater_variation(r['variation'], r['variation_pct'])} sur {r['releves']} relevé(s)"
+            )
+        texte = "\n\n".join(blocs)
+    envoyeur.envoyer(message.chat_id, texte, reply_to_message_id=message.message_id)
+
+async def commande_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/top [jours] : plus fortes hausses et baisses sur la période."""
+    message = update.effective_message
+    jours = lire_jours(context.args or [], 0)
+    top = await asyncio.to_thread(historique.top, jours)
+    if not top["comptes"]:
+        texte = f"Aucun relevé sur les {jours:g} derniers jours."
+    else:
+        lignes = [f"🏆 {jours:g} derniers jours ({top['comptes']} comptes)"]
+        for titre, entrees in (("Hausses", top["hausses"]), ("Baisses", top["baisses"])):
+            if entrees:
+                lignes.append(f"\n{titre} :")
+                lignes.extend(
+                    f"• @{v['username']} ({v['reseau']}) {formater_variation(v['variation'], v['variation_pct'])} → {formater_nombre(v['followers'])}"
+                    for v in entrees
+                )
+        texte = "\n".join(lignes)
+    envoyeur.envoyer(message.chat_id, texte, reply_to_message_id=message.message_id)
+
+async def importer_historique_sheet():
+    """Import unique du contenu existant de la feuille dans l_historique local."""
+    try:
+        if await asyncio.to_thread(historique.import_fait):
+            return
+        sheet = await demarrage["sheets"].attendre()
+        lignes = await asyncio.to_thread(sheet.get_all_values)
+        nb = await asyncio.to_thread(historique.importer_lignes_sheet, lignes)
+        logger.info(f"Historique local : {nb} relevé(s) importé(s) depuis Google Sheets.")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Import de l_historique depuis Google Sheets impossible (nouvel essai au prochain démarrage): {e}")
+
+def lancer_processus_workers():
+    # "spawn" : chaque process réimporte main.py et crée ses propres clients (gRPC n_aime pas fork).
+    # Pas daemon : un process daemon ne peut pas avoir d_enfants (pool Tesseract). L_arrêt est
+    # fait par arreter_services, ou à la sortie de l_interpréteur (atexit) si on n_y passe pas.
+    contexte = multiprocessing.get_context("spawn")
+    for i in range(JOB_WORKER_PROCESSES):
+        processus = contexte.Process(target=worker_main, name=f"worker-process-{i}", daemon=False)
+        processus.start()
+        processus_workers.append(processus)
+        logger.info(f"Process worker {processus.name} lancé (pid {processus.pid}).")
+    if processus_workers:
+        # Enregistré après start() : passe avant le join des enfants par multiprocessing (atexit = LIFO)
+        atexit.register(arreter_processus_workers)
+
+def arreter_processus_workers():
+    for processus in processus_workers:
+        processus.terminate()  # SIGTERM : le worker termine son lot en cours puis s_arrête
+    for processus in processus_workers:
+        processus.join(timeout=JOB_VISIBILITE_S)
+    processus_workers.clear()
+
+def lancer_resume_metriques():
+    if METRIQUES_RESUME_INTERVALLE_S > 0:
+        taches_workers.append(asyncio.create_task(boucle_resume(METRIQUES_RESUME_INTERVALLE_S, arret_workers)))
+
+async def demarrer_services(application: Application) -> None:
+    demarrage.lancer()
+    await sheets_writer.demarrer()
+    await envoyeur.demarrer()
+    arret_workers.clear()
+    for i in range(JOB_WORKERS):
+        taches_workers.append(asyncio.create_task(boucle_worker(f"worker-{i}", arret_workers)))
+    lancer_resume_metriques()
+    if HISTORIQUE_IMPORT_SHEET:
+        taches_fond.append(asyncio.create_task(importer_historique_sheet()))
+    lancer_processus_workers()
+
+async def arreter_services(application: Application) -> None:
+    arret_workers.set()
+    for tache in taches_fond:
+        tache.cancel()
+    await asyncio.gather(*taches_workers, *taches_fond, return_exceptions=True)
+    taches_fond.clear()
+    taches_workers.clear()
+    await asyncio.to_thread(arreter_processus_workers)
+    await demarrage.arreter()
+    await envoyeur.arreter()
+    await sheets_writer.arreter()
+    historique.fermer()
+    dedup_index.fermer()
+    file_jobs.fermer()
+    ocr_executor.shutdown(wait=False, cancel_futures=True)
+    if ocr_tesseract is not None:
+        ocr_tesseract.fermer()
+
+async def executer_worker():
+    """Worker autonome (sans réception Telegram) : consomme la file jusqu_à SIGTERM / SIGINT."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, arret_workers.set)
+    demarrage.lancer()
+    await sheets_writer.demarrer()
+    await envoyeur.demarrer()
+    lancer_resume_metriques()
+    try:
+        await asyncio.gather(*(boucle_worker(f"worker-{os.getpid()}-{i}", arret_workers) for i in range(max(1, JOB_WORKERS))))
+    finally:
+        await asyncio.gather(*taches_workers, return_exceptions=True)
+        taches_workers.clear()
+        await demarrage.arreter()
+        await envoyeur.arreter()
+        await sheets_writer.arreter()
+        historique.fermer()
+        dedup_index.fermer()
+        file_jobs.fermer()
+        ocr_executor.shutdown(wait=False, cancel_futures=True)
+        if ocr_tesseract is not None:
+            ocr_tesseract.fermer()
+
+def worker_main() -> None:
+    asyncio.run(executer_worker())
+
+def construire_application() -> Application:
+    # concurrent_updates : plusieurs photos sont traitées en parallèle (l_OCR se chevauche),
+    # dans la limite de OCR_MAX_EN_ATTENTE mises à jour en cours.
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(OCR_MAX_EN_ATTENTE)
+        .post_init(demarrer_services)
+        .post_shutdown(arreter_services)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.PHOTO & filters.ChatType.GROUPS, handle_photo))
+    application.add_handler(CommandHandler("stats", commande_stats))
+    application.add_handler(CommandHandler("top", commande_top))
+    logger.info("Gestionnaires de photos et de commandes (/stats, /top) ajoutés.")
+    return application
+
+# --- Mode webhook (uvicorn main:app) ----------------------------------------------
+# Telegram pousse les updates sur WEBHOOK_PATH ; on répond 200 tout de suite et le traitement
+# se fait dans la file de l_Application. Sans URL publique, repli sur le polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_URL else "polling")
+
+application = construire_application()
+
+def verifier_configuration_webhook():
+    if BOT_MODE not in ("webhook", "polling"):
+        raise ErreurConfiguration(f"BOT_MODE={BOT_MODE!r} invalide : \"webhook\" ou \"polling\" attendu.")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise ErreurConfiguration("BOT_MODE=webhook mais ni WEBHOOK_URL ni RENDER_EXTERNAL_URL ne sont définies.")
+    if not WEBHOOK_PATH.startswith("/"):
+        raise ErreurConfiguration(f"WEBHOOK_PATH={WEBHOOK_PATH!r} doit commencer par \"/\".")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cycle de vie PTB calqué sur celui d_uvicorn (post_init / post_shutdown appelés à la main,
+    # comme le ferait run_webhook / run_polling)
+    verifier_configuration_webhook()
+    await application.initialize()
+    try:
+        # Dans le try : si set_webhook échoue, les services déjà lancés sont arrêtés
+        await demarrer_services(application)
+        await application.start()
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_SECRET:
+                logger.warning("WEBHOOK_SECRET non défini : les appels au webhook ne sont pas authentifiés.")
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Mode webhook actif sur {WEBHOOK_PATH}.")
+        else:
+            await application.bot.delete_webhook()
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            logger.info("Mode polling actif (aucune URL de webhook).")
+        yield
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await arreter_services(application)
+        await application.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.post(WEBHOOK_PATH)
+async def webhook_telegram(request: Request) -> Response:
+    if WEBHOOK_SECRET and not hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET
+    ):
+        return Response(status_code=403)
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except Exception as e:
+        logger.warning(f"Update webhook illisible: {e}")
+        return Response(status_code=400)
+    # Accusé de réception immédiat ; le traitement se fait en tâche de fond
+    await application.update_queue.put(update)
+    return Response(status_code=200)
+
+@app.get("/healthz")
+async def healthz() -> JSONResponse:
+    # Vivant dès que l_app répond ; l_état des composants est donné à titre indicatif
+    return JSONResponse({"statut": "ok", "composants": demarrage.etat()})
+
+@app.get("/readyz")
+async def readyz() -> JSONResponse:
+    pret = demarrage.pret()
+    return JSONResponse(
+        {"pret": pret, "composants": demarrage.etat(), "file_jobs": await asyncio.to_thread(file_jobs.profondeur)},
+        status_code=200 if pret else 503,
+    )
+
+@app.get("/metrics")
+async def metriques() -> PlainTextResponse:
+    # Les jauges lisent SQLite : exposition hors de la boucle asyncio
+    texte = await asyncio.to_thread(REGISTRE.exposer)
+    return PlainTextResponse(texte, media_type="text/plain; version=0.0.4")
 
 def main() -> None:
-    logger.info("Démarrage du bot...")
-    application = Application.builder().token(TOKEN).build()
-    application.add_handler(MessageHandler(filters.PHOTO & filters.ChatType.GROUPS, handle_photo))
-    logger.info("Gestionnaire de photos ajouté.")
-    application.run_polling()
+    # python main.py worker : worker seul, à lancer sur une autre machine / un autre conteneur
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        logger.info("Démarrage d_un worker autonome...")
+        worker_main()
+        return
+    logger.info("Démarrage du bot (polling)...")
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
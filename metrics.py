@@ -0,0 +1,239 @@
+"""Métriques internes (compteurs, jauges, histogrammes) au format texte Prometheus.
+
+Sans dépendance externe : un registre en mémoire par process, exposé par la route
+/metrics de l_app FastAPI et résumé périodiquement dans les logs. Les process workers
+lancés à part (JOB_WORKER_PROCESSES) ont leur propre registre et ne loguent que le résumé.
+"""
+import asyncio
+import contextlib
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_SECONDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(noms: tuple, valeurs: tuple) -> str:
+    if not noms:
+        return ""
+    paires = ",".join(f'{nom}="{str(valeur)}"' for nom, valeur in zip(noms, valeurs))
+    return "{" + paires + "}"
+
+
+class _Metrique:
+    type_prometheus = ""
+
+    def __init__(self, nom: str, description: str, labels: tuple = ()):
+        self.nom = nom
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _cle(self, labels: dict) -> tuple:
+        return tuple(labels.get(nom, "") for nom in self.labels)
+
+    def exposer(self) -> list:
+        return [f"# HELP {self.nom} {self.description}", f"# TYPE {self.nom} {self.type_prometheus}"]
+
+
+class Compteur(_Metrique):
+    type_prometheus = "counter"
+
+    def __init__(self, nom, description, labels=()):
+        super().__init__(nom, description, labels)
+        self._valeurs = {}
+
+    def inc(self, valeur: float = 1.0, **labels):
+        cle = self._cle(labels)
+        with self._lock:
+            self._valeurs[cle] = self._valeurs.get(cle, 0.0) + valeur
+
+    def valeur(self, **labels) -> float:
+        with self._lock:
+            return self._valeurs.get(self._cle(labels), 0.0)
+
+    def exposer(self) -> list:
+        lignes = super().exposer()
+        with self._lock:
+            for cle, valeur in sorted(self._valeurs.items()):
+                lignes.append(f"{self.nom}{_format_labels(self.labels, cle)} {valeur}")
+        return lignes
+
+
+class Jauge(_Metrique):
+    """Valeur lue à la demande (profondeur de file, taille du spool...)."""
+    type_prometheus = "gauge"
+
+    def __init__(self, nom, description, lecture=None):
+        super().__init__(nom, description)
+        self.lecture = lecture
+
+    def exposer(self) -> list:
+        lignes = super().exposer()
+        if self.lecture is not None:
+            try:
+                lignes.append(f"{self.nom} {float(self.lecture())}")
+            except Exception as e:
+                logger.debug("Jauge %s illisible: %s", self.nom, e)
+        return lignes
+
+
+class Histogramme(_Metrique):
+    type_prometheus = "histogram"
+
+    def __init__(self, nom, description, labels=(), buckets=BUCKETS_SECONDES):
+        super().__init__(nom, description, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # cle -> [compteurs par bucket..., +Inf], somme
+
+    def observer(self, valeur: float, **labels):
+        cle = self._cle(labels)
+        with self._lock:
+            serie = self._series.get(cle)
+            if serie is None:
+                serie = self._series[cle] = [[0] * (len(self.buckets) + 1), 0.0]
+            for i, borne in enumerate(self.buckets):
+                if valeur <= borne:
+                    serie[0][i] += 1
+                    break
+            else:
+                serie[0][-1] += 1
+            serie[1] += valeur
+
+    @contextlib.contextmanager
+    def chronometrer(self, **labels):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observer(time.perf_counter() - debut, **labels)
+
+    def resume(self) -> dict:
+        """{labels: (nombre, moyenne, p95 approximatif d_après les buckets)}."""
+        resultat = {}
+        with self._lock:
+            for cle, (compteurs, somme) in self._series.items():
+                total = sum(compteurs)
+                if not total:
+                    continue
+                cumul, p95 = 0, float("inf")
+                for borne, n in zip(self.buckets + (float("inf"),), compteurs):
+                    cumul += n
+                    if cumul >= 0.95 * total:
+                        p95 = borne
+                        break
+                resultat[cle] = (total, somme / total, p95)
+        return resultat
+
+    def exposer(self) -> list:
+        lignes = super().exposer()
+        with self._lock:
+            for cle, (compteurs, somme) in sorted(self._series.items()):
+                cumul = 0
+                for borne, n in zip(self.buckets + (float("inf"),), compteurs):
+                    cumul += n
+                    le = "+Inf" if borne == float("inf") else repr(borne)
+                    labels = _format_labels(self.labels + ("le",), cle + (le,))
+                    lignes.append(f"{self.nom}_bucket{labels} {cumul}")
+                labels = _format_labels(self.labels, cle)
+                lignes.append(f"{self.nom}_sum{labels} {somme}")
+                lignes.append(f"{self.nom}_count{labels} {cumul}")
+        return lignes
+
+
+class Registre:
+    def __init__(self):
+        self._metriques = {}
+
+    def enregistrer(self, metrique):
+        self._metriques[metrique.nom] = metrique
+        return metrique
+
+    def compteur(self, nom, description, labels=()) -> Compteur:
+        return self._metriques.get(nom) or self.enregistrer(Compteur(nom, description, labels))
+
+    def jauge(self, nom, description, lecture=None) -> Jauge:
+        jauge = self._metriques.get(nom) or self.enregistrer(Jauge(nom, description))
+        if lecture is not None:
+            jauge.lecture = lecture
+        return jauge
+
+    def histogramme(self, nom, description, labels=(), buckets=BUCKETS_SECONDES) -> Histogramme:
+        return self._metriques.get(nom) or self.enregistrer(Histogramme(nom, description, labels, buckets))
+
+    def exposer(self) -> str:
+        lignes = []
+        for metrique in self._metriques.values():
+            lignes.extend(metrique.exposer())
+        return "\n".join(lignes) + "\n"
+
+    def resume_texte(self) -> str:
+        morceaux = []
+        for metrique in self._metriques.values():
+            if isinstance(metrique, Compteur):
+                with metrique._lock:
+                    for cle, valeur in metrique._valeurs.items():
+                        morceaux.append(f"{metrique.nom}{_format_labels(metrique.labels, cle)}={valeur:g}")
+            elif isinstance(metrique, Histogramme):
+                for cle, (n, moyenne, p95) in metrique.resume().items():
+                    morceaux.append(
+                        f"{metrique.nom}{_format_labels(metrique.labels, cle)}: n={n} moy={moyenne * 1000:.0f}ms p95<={p95 * 1000:.0f}ms"
+                    )
+            elif isinstance(metrique, Jauge) and metrique.lecture is not None:
+                with contextlib.suppress(Exception):
+                    morceaux.append(f"{metrique.nom}={float(metrique.lecture()):g}")
+        return " | ".join(morceaux)
+
+
+REGISTRE = Registre()
+
+# Métriques communes au bot et aux workers
+DUREE_ETAPE = REGISTRE.histogramme("bot_etape_duree_secondes", "Durée de chaque étape du traitement d_une photo", labels=("etape",))
+IMAGES_TRAITEES = REGISTRE.compteur("bot_images_traitees_total", "Photos traitées jusqu_au bout")
+ECHECS_OCR = REGISTRE.compteur("bot_ocr_echecs_total", "Photos sans résultat OCR exploitable", labels=("raison",))
+COMPTES_INCONNUS = REGISTRE.compteur("bot_comptes_inconnus_total", "Photos dont le réseau / compte n_a pas été identifié")
+ERREURS_SHEETS = REGISTRE.compteur("bot_sheets_erreurs_total", "Erreurs d_écriture Google Sheets", labels=("type",))
+DEDUP_HITS = REGISTRE.compteur("bot_dedup_hits_total", "Photos ignorées car déjà traitées")
+JOBS_DEAD_LETTER = REGISTRE.compteur("bot_jobs_dead_letter_total", "Jobs abandonnés après trop de tentatives")
+OCR_NIVEAU = REGISTRE.compteur("bot_ocr_niveau_total", "Photos résolues par niveau d_OCR (cache, tesseract, vision)", labels=("niveau",))
+OCR_ESCALADES = REGISTRE.compteur("bot_ocr_escalades_total", "Photos passées de Tesseract à Vision", labels=("raison",))
+OCR_CACHE = REGISTRE.compteur("bot_ocr_cache_total", "Recherches dans le cache OCR (hit_exact, hit_proche, miss)", labels=("resultat",))
+
+
+async def boucle_resume(intervalle_s: float, arret: asyncio.Event):
+    """Log un résumé des métriques toutes les `intervalle_s` secondes."""
+    while not arret.is_set():
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(arret.wait(), timeout=intervalle_s)
+        # Hors de la boucle d_événements : les jauges lisent les bases SQLite (file de jobs, spool)
+        resume = await asyncio.to_thread(REGISTRE.resume_texte)
+        if resume:
+            logger.info(f"Métriques: {resume}")
+
+
+def profil_echantillonne(taux: float, nb_lignes: int = 15):
+    """Décorateur : profile (cProfile) une fraction `taux` des appels et log les fonctions les plus coûteuses."""
+    def decorateur(fonction):
+        if taux <= 0:
+            return fonction
+
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            if random.random() >= taux:
+                return fonction(*args, **kwargs)
+            profil = cProfile.Profile()
+            try:
+                return profil.runcall(fonction, *args, **kwargs)
+            finally:
+                sortie = io.StringIO()
+                pstats.Stats(profil, stream=sortie).sort_stats("cumulative").print_stats(nb_lignes)
+                logger.info(f"Profil échantillonné de {fonction.__name__}:\n{sortie.getvalue()}")
+        return enveloppe
+    return decorateur
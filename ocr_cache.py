@@ -0,0 +1,142 @@
+"""Cache des résultats OCR, adressé par le contenu de l_image.
+
+Deux clés par entrée : un SHA-256 exact des octets et un dHash perceptuel 64 bits (Pillow).
+Seul un hit exact évite l_appel Vision et la passe d_identification : on réutilise les
+annotations sérialisées et le triplet (reseau, username, followers) déjà extrait.
+
+Un hit « proche » (dHash) n_est qu_un indice de repost : deux profils de comptes différents,
+ou le même profil avec un autre compteur, ont le même dHash 9x8 (même mise en page). L_entrée
+est renvoyée avec "proche": True et l_appelant ne doit pas en réutiliser le résultat.
+Désactivé par défaut (distance_max=0).
+
+La recherche « proche » passe par 4 bandes de 16 bits (si deux hash sont à distance de
+Hamming <= 3, au moins une bande est identique) puis vérifie la distance exacte.
+"""
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+NB_BANDES = 4
+BITS_PAR_BANDE = 16
+
+
+def hash_contenu(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_perceptuel(content: bytes) -> int:
+    """dHash 64 bits : compare chaque pixel à son voisin de droite sur une vignette 9x8 en niveaux de gris."""
+    with Image.open(io.BytesIO(content)) as img:
+        # draft() laisse le décodeur JPEG sous-échantillonner directement : bien plus rapide qu_un décodage complet
+        img.draft("L", (64, 64))
+        img = ImageOps.exif_transpose(img).convert("L").resize((9, 8), Image.BILINEAR)
+        pixels = list(img.getdata())
+    valeur = 0
+    for ligne in range(8):
+        for col in range(8):
+            gauche = pixels[ligne * 9 + col]
+            droite = pixels[ligne * 9 + col + 1]
+            valeur = (valeur << 1) | (1 if gauche > droite else 0)
+    return valeur
+
+
+def _bandes(phash: int) -> list:
+    masque = (1 << BITS_PAR_BANDE) - 1
+    return [(i, (phash >> (i * BITS_PAR_BANDE)) & masque) for i in range(NB_BANDES)]
+
+
+class OcrCache:
+    def __init__(self, taille_max: int = 2000, ttl_s: float = 6 * 3600, distance_max: int = 0):
+        self.taille_max = taille_max
+        self.ttl_s = ttl_s
+        # 0 = uniquement les hits exacts (voir plus haut : un hit proche ne prouve rien sur le contenu)
+        self.distance_max = min(distance_max, NB_BANDES - 1)
+        self._entrees = OrderedDict()  # sha256 -> entrée
+        self._bandes = {}  # (n° bande, valeur) -> set(sha256)
+        self._lock = threading.Lock()
+        self.hits_exacts = 0
+        self.hits_proches = 0
+        self.misses = 0
+
+    def _retirer(self, cle: str):
+        entree = self._entrees.pop(cle, None)
+        if entree is None:
+            return
+        for bande in _bandes(entree["phash"]):
+            cles = self._bandes.get(bande)
+            if cles is not None:
+                cles.discard(cle)
+                if not cles:
+                    del self._bandes[bande]
+
+    def _valide(self, cle: str, maintenant: float) -> dict | None:
+        entree = self._entrees.get(cle)
+        if entree is None:
+            return None
+        if maintenant - entree["cree_le"] > self.ttl_s:
+            self._retirer(cle)
+            return None
+        self._entrees.move_to_end(cle)
+        return entree
+
+    def chercher(self, sha256: str, phash: int | None) -> dict | None:
+        """Retourne l_entrée en cache (annotations + resultat) ou None.
+
+        Hit proche : copie de l_entrée avec "proche": True, à ne pas réutiliser comme résultat.
+        """
+        maintenant = time.time()
+        with self._lock:
+            entree = self._valide(sha256, maintenant)
+            if entree is not None:
+                self.hits_exacts += 1
+                return entree
+            if phash is not None and self.distance_max > 0:
+                candidats = set()
+                for bande in _bandes(phash):
+                    candidats |= self._bandes.get(bande, set())
+                meilleure, meilleure_distance = None, self.distance_max + 1
+                for cle in candidats:
+                    distance = bin(self._entrees[cle]["phash"] ^ phash).count("1")
+                    if distance < meilleure_distance:
+                        meilleure, meilleure_distance = cle, distance
+                if meilleure is not None:
+                    entree = self._valide(meilleure, maintenant)
+                    if entree is not None:
+                        self.hits_proches += 1
+                        logger.info(f"OcrCache: quasi-doublon trouvé (distance de Hamming {meilleure_distance}).")
+                        return {**entree, "proche": True}
+            self.misses += 1
+            return None
+
+    def stocker(self, sha256: str, phash: int | None, annotations: list, resultat: tuple):
+        with self._lock:
+            self._retirer(sha256)
+            self._entrees[sha256] = {
+                "phash": phash or 0,
+                "annotations": annotations,
+                "resultat": resultat,
+                "cree_le": time.time(),
+            }
+            if phash is not None:
+                for bande in _bandes(phash):
+                    self._bandes.setdefault(bande, set()).add(sha256)
+            while len(self._entrees) > self.taille_max:
+                self._retirer(next(iter(self._entrees)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits_exacts + self.hits_proches + self.misses
+            return {
+                "entrees": len(self._entrees),
+                "hits_exacts": self.hits_exacts,
+                "hits_proches": self.hits_proches,
+                "misses": self.misses,
+                "taux_hit": (self.hits_exacts + self.hits_proches) / total if total else 0.0,
+            }
@@ -0,0 +1,63 @@
+"""Enregistrement / chargement de fixtures OCR (réponses Vision sérialisées).
+
+Une fixture = un fichier JSON `<sha256 de l_image>.json` :
+
+    {
+      "sha256": "...",
+      "enregistre_le": "2024-05-01 12:00:00",
+      "text_annotations": [{"description": "...", "vertices": [[x, y], ...]}, ...],
+      "obtenu": {"reseau": "Instagram", "username": "cmoitalia", "followers": "12345"},
+      "attendu": null
+    }
+
+"attendu" est à remplir à la main (même forme que "obtenu") pour mesurer la précision.
+"""
+import datetime
+import json
+import logging
+import os
+
+from annotations import annotations_vers_dicts, dicts_vers_annotations
+
+logger = logging.getLogger(__name__)
+
+
+def enregistrer_fixture(dossier: str, sha256: str, text_annotations, resultat: tuple) -> str:
+    os.makedirs(dossier, exist_ok=True)
+    chemin = os.path.join(dossier, f"{sha256}.json")
+    reseau, username, followers = resultat
+    fixture = {
+        "sha256": sha256,
+        "enregistre_le": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "text_annotations": annotations_vers_dicts(text_annotations),
+        "obtenu": {"reseau": reseau, "username": username, "followers": followers},
+        "attendu": None,
+    }
+    # Ne pas écraser une fixture déjà étiquetée
+    if os.path.exists(chemin):
+        return chemin
+    tmp = f"{chemin}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False)
+    os.replace(tmp, chemin)
+    return chemin
+
+
+def charger_fixture(chemin: str) -> dict:
+    with open(chemin, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+    fixture["annotations"] = dicts_vers_annotations(fixture.get("text_annotations", []))
+    fixture["chemin"] = chemin
+    return fixture
+
+
+def charger_fixtures(dossier: str) -> list:
+    fixtures = []
+    for nom in sorted(os.listdir(dossier)):
+        if not nom.endswith(".json"):
+            continue
+        try:
+            fixtures.append(charger_fixture(os.path.join(dossier, nom)))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Fixture {nom} illisible, ignorée: {e}")
+    return fixtures
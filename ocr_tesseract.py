@@ -0,0 +1,119 @@
+"""Niveau OCR local (Tesseract) placé devant Google Vision.
+
+La plupart des captures sont des pages de profil propres : Tesseract, lancé dans un pool
+de process (il est lié au CPU), suffit souvent. Sa sortie est convertie dans la même
+forme que les `text_annotations` Vision (annotation 0 = texte complet, puis un mot par
+annotation avec sa bounding box), donc l_extraction ne voit pas la différence.
+Le choix d_escalader vers Vision se fait dans main.py, après identification.
+
+pytesseract et le binaire tesseract sont optionnels : sans eux, tout part chez Vision.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from annotations import dicts_vers_annotations
+
+try:
+    import pytesseract
+except ImportError:  # dépendance optionnelle
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+
+def tesseract_disponible() -> bool:
+    if pytesseract is None:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def ocr_image(contenu: bytes, langues: str, config: str, confiance_min: float, timeout_s: float) -> list:
+    """OCR d_une image ; retourne des dicts {"description", "vertices", "confiance"} (voir annotations.py).
+
+    Fonction de module (et non méthode) : elle est exécutée dans les process du pool.
+    """
+    with Image.open(io.BytesIO(contenu)) as img:
+        donnees = pytesseract.image_to_data(
+            img, lang=langues, config=config, output_type=pytesseract.Output.DICT, timeout=timeout_s
+        )
+    mots = []
+    lignes = {}  # (bloc, paragraphe, ligne) -> mots, dans l_ordre de lecture
+    for i, texte in enumerate(donnees["text"]):
+        texte = texte.strip()
+        if not texte or float(donnees["conf"][i]) < confiance_min:
+            continue
+        x, y = donnees["left"][i], donnees["top"][i]
+        x2, y2 = x + donnees["width"][i], y + donnees["height"][i]
+        mots.append({
+            "description": texte,
+            "vertices": [[x, y], [x2, y], [x2, y2], [x, y2]],
+            "confiance": float(donnees["conf"][i]),
+        })
+        cle = (donnees["block_num"][i], donnees["par_num"][i], donnees["line_num"][i])
+        lignes.setdefault(cle, []).append(texte)
+    if not mots:
+        return []
+    x_min = min(m["vertices"][0][0] for m in mots)
+    y_min = min(m["vertices"][0][1] for m in mots)
+    x_max = max(m["vertices"][2][0] for m in mots)
+    y_max = max(m["vertices"][2][1] for m in mots)
+    complet = {
+        "description": "\n".join(" ".join(ligne) for ligne in lignes.values()),
+        "vertices": [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]],
+    }
+    return [complet] + mots
+
+
+class OcrTesseract:
+    def __init__(self, max_workers: int | None = None, langues: str = "fra+eng",
+                 config: str = "--oem 1 --psm 11", confiance_min: float = 60.0, timeout_s: float = 20.0):
+        self.langues = langues
+        self.config = config
+        self.confiance_min = confiance_min
+        self.timeout_s = timeout_s
+        self.max_workers = max_workers
+        self._pool = self._nouveau_pool()
+
+    def _nouveau_pool(self) -> ProcessPoolExecutor:
+        # "spawn" comme pour les process workers ; les process ne sont créés qu_au premier appel
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def _ocr(self, pool: ProcessPoolExecutor, contenu: bytes) -> list:
+        # Dans une coroutine : une erreur levée dès la soumission (pool cassé, process démon…)
+        # est récupérée par gather comme une erreur d_OCR
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            pool, ocr_image, contenu, self.langues, self.config, self.confiance_min, self.timeout_s
+        )
+
+    async def detecter_lot(self, contenus: list) -> list:
+        """Une liste de TextAnnotation par image (vide si aucun texte), ou None si Tesseract a échoué."""
+        pool = self._pool
+        resultats = await asyncio.gather(*(self._ocr(pool, contenu) for contenu in contenus), return_exceptions=True)
+        annotations = []
+        for resultat in resultats:
+            if isinstance(resultat, Exception):
+                logger.warning(f"Tesseract: échec de l_OCR ({resultat!r}), escalade vers Vision.")
+                annotations.append(None)
+            else:
+                annotations.append(dicts_vers_annotations(resultat))
+        # Un process du pool mort (crash de tesseract, OOM) casse tout le pool : on le remplace,
+        # sinon tous les lots suivants échoueraient aussi
+        if pool is self._pool and any(isinstance(r, BrokenProcessPool) for r in resultats):
+            logger.warning("Tesseract: pool de process cassé, recréé.")
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._nouveau_pool()
+        return annotations
+
+    def fermer(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
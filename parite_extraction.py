@@ -0,0 +1,96 @@
+"""Contrôle de non-régression de extraire_followers_spatial sur un jeu d_annotations fixe.
+
+Les jeux d_annotations sont générés de façon déterministe (graine fixe) : mots-clés,
+nombres sous toutes leurs formes ("1,2k", "12 345", "10:30"…) placés au hasard ou sur
+quelques lignes communes, pour exercer la fusion Instagram, la fenêtre spatiale et les
+replis. Les résultats attendus (data/parite_extraction.json) ont été produits par
+l_implémentation d_origine (double boucle sur toutes les paires mot-clé x nombre) ; toute
+optimisation de l_extraction doit les retrouver à l_identique.
+
+Usage :
+    python parite_extraction.py
+    python parite_extraction.py --enregistrer   # après un changement de comportement voulu
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+
+from annotations import BoundingPoly, TextAnnotation, Vertex
+from extraction import MOTS_CLES_FOLLOWERS_SPECIFIQUES, extraire_followers_spatial
+
+MOTS = [
+    "followers", "abonnés", "suivi(e)s", "publications", "12", "345", "1,2k", "3.4m", "10:30", "678",
+    "1 234", "56", "k", "abc", "9", "12.5k", "100", "2,345", "0", "1.1m", "talia",
+]
+RESEAUX = ["instagram", "twitter", "threads", "tiktok"]
+LIGNES_COMMUNES = [200, 210, 300, 305]
+
+
+def generer_jeux(nb: int, graine: int) -> list:
+    aleatoire = random.Random(graine)
+    jeux = []
+    for _ in range(nb):
+        annotations = [TextAnnotation("texte complet")]
+        for _ in range(aleatoire.randint(0, 40)):
+            x = aleatoire.uniform(0, 800)
+            if aleatoire.random() < 0.5:
+                y = aleatoire.uniform(0, 1600)
+            else:
+                y = aleatoire.choice(LIGNES_COMMUNES) + aleatoire.uniform(-15, 15)
+            largeur = aleatoire.uniform(5, 60)
+            x, y, x2 = int(x), int(y), int(x + largeur)
+            annotations.append(TextAnnotation(
+                aleatoire.choice(MOTS),
+                BoundingPoly([Vertex(x, y), Vertex(x2, y), Vertex(x2, y + 20), Vertex(x, y + 20)]),
+            ))
+        jeux.append(annotations)
+    return jeux
+
+
+def calculer(jeux: list) -> list:
+    return [
+        [extraire_followers_spatial(annotations, MOTS_CLES_FOLLOWERS_SPECIFIQUES[reseau], reseau) for reseau in RESEAUX]
+        for annotations in jeux
+    ]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Non-régression de l_extraction spatiale des followers.")
+    parser.add_argument("--attendu", default="data/parite_extraction.json", help="Résultats de référence")
+    parser.add_argument("--enregistrer", action="store_true", help="Remplace la référence par les résultats actuels")
+    parser.add_argument("--jeux", type=int, default=3000, help="Nombre de jeux (avec --enregistrer)")
+    parser.add_argument("--graine", type=int, default=1, help="Graine du générateur (avec --enregistrer)")
+    args = parser.parse_args(argv)
+
+    # Les avertissements de repli de l_extraction ne servent à rien ici
+    logging.disable(logging.CRITICAL)
+
+    if args.enregistrer:
+        resultats = calculer(generer_jeux(args.jeux, args.graine))
+        with open(args.attendu, "w", encoding="utf-8") as f:
+            json.dump({"graine": args.graine, "reseaux": RESEAUX, "resultats": resultats}, f, ensure_ascii=False)
+        print(f"{len(resultats)} jeux x {len(RESEAUX)} réseaux enregistrés dans {args.attendu}")
+        return 0
+
+    with open(args.attendu, "r", encoding="utf-8") as f:
+        reference = json.load(f)
+    if reference["reseaux"] != RESEAUX:
+        print(f"Référence pour d_autres réseaux ({reference['reseaux']}) : relancer avec --enregistrer.", file=sys.stderr)
+        return 1
+    resultats = calculer(generer_jeux(len(reference["resultats"]), reference["graine"]))
+    differences = 0
+    for i, (attendu, obtenu) in enumerate(zip(reference["resultats"], resultats)):
+        for reseau, a, o in zip(RESEAUX, attendu, obtenu):
+            if a != o:
+                differences += 1
+                if differences <= 20:
+                    print(f"  ✗ jeu {i} ({reseau}): attendu {a!r}, obtenu {o!r}")
+    total = len(resultats) * len(RESEAUX)
+    print(f"{total - differences}/{total} résultats identiques à la référence")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
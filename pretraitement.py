@@ -0,0 +1,91 @@
+"""Prétraitement des images avant OCR, pour alléger ce qu_on envoie à Vision.
+
+Rotation EXIF, niveaux de gris, réduction à une dimension max, recadrage optionnel sur
+l_en-tête du profil (là où sont le handle et les compteurs), puis ré-encodage JPEG.
+Les coordonnées renvoyées par l_OCR sur l_image réduite sont ramenées dans le repère de
+la photo d_origine (voir reprojeter_annotations) : les seuils en pixels de l_extraction
+spatiale restent valables.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+from annotations import BoundingPoly, TextAnnotation, Vertex
+
+# Part de la hauteur (depuis le haut) qui contient l_en-tête du profil, par réseau.
+# None = réseau encore inconnu : on garde la plus grande région.
+REGIONS_ENTETE = {
+    "instagram": 0.45,
+    "threads": 0.40,
+    "twitter": 0.50,
+    "tiktok": 0.55,
+    None: 0.55,
+}
+
+
+def choisir_taille_photo(photos: list, max_dimension: int) -> dict:
+    """Plus petite variante ({"file_id", "width", "height", "file_size"}) qui atteint `max_dimension`, sinon la plus grande."""
+    for photo in sorted(photos, key=lambda p: max(p["width"], p["height"])):
+        if max(photo["width"], photo["height"]) >= max_dimension:
+            return photo
+    return photos[-1]
+
+
+def pretraiter_image(content: bytes, max_dimension: int = 1600, niveaux_de_gris: bool = True,
+                     recadrage_entete: bool = False, reseau: str | None = None,
+                     qualite_jpeg: int = 85, facteur_reference: float = 1.0):
+    """Retourne (octets à envoyer à l_OCR, échelle = taille envoyée / taille de référence).
+
+    Le recadrage part du coin haut-gauche : seule l_échelle est nécessaire pour reprojeter.
+    `facteur_reference` : rapport entre la photo de référence (la plus grande variante
+    Telegram) et celle qu_on a téléchargée, si on a pris une variante plus petite.
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        cote_origine = max(img.size)
+        if max_dimension:
+            # Décodage JPEG directement à échelle réduite (1/2, 1/4, 1/8) quand c_est possible
+            img.draft("L" if niveaux_de_gris else "RGB", (max_dimension, max_dimension))
+        img = ImageOps.exif_transpose(img)
+        # Rapport des plus grands côtés : indépendant d_une éventuelle rotation EXIF
+        echelle = max(img.size) / cote_origine
+
+        if niveaux_de_gris and img.mode != "L":
+            img = img.convert("L")
+        elif img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+
+        if recadrage_entete:
+            part = REGIONS_ENTETE.get(reseau, REGIONS_ENTETE[None])
+            hauteur = int(img.size[1] * part)
+            if 0 < hauteur < img.size[1]:
+                img = img.crop((0, 0, img.size[0], hauteur))
+
+        if max_dimension and max(img.size) > max_dimension:
+            ratio = max_dimension / max(img.size)
+            img = img.resize((max(1, round(img.size[0] * ratio)), max(1, round(img.size[1] * ratio))), Image.LANCZOS)
+            echelle *= ratio
+
+        sortie = io.BytesIO()
+        img.save(sortie, format="JPEG", quality=qualite_jpeg, optimize=True)
+        resultat = sortie.getvalue()
+
+    if len(resultat) >= len(content) and echelle == 1.0 and not recadrage_entete:
+        # Rien gagné : on envoie l_original tel quel
+        return content, 1.0 / facteur_reference
+    return resultat, echelle / facteur_reference
+
+
+def reprojeter_annotations(text_annotations, echelle: float) -> list:
+    """Ramène les bounding boxes dans le repère de référence. Retourne des TextAnnotation."""
+    resultat = []
+    for annotation in text_annotations:
+        vertices = getattr(getattr(annotation, "bounding_poly", None), "vertices", None) or []
+        resultat.append(TextAnnotation(
+            description=annotation.description,
+            bounding_poly=BoundingPoly(vertices=[
+                Vertex(round(v.x / echelle), round(v.y / echelle))
+                for v in vertices
+            ]),
+            confiance=getattr(annotation, "confiance", None),
+        ))
+    return resultat
@@ -0,0 +1,273 @@
+"""Écriture différée (write-behind) vers Google Sheets.
+
+Les lignes sont d_abord posées dans un spool SQLite local (elles survivent à un crash),
+puis une tâche de fond les envoie par lots avec `append_rows` dès que le lot est plein
+ou que l_intervalle de flush est écoulé. Les erreurs 429/5xx sont retentées avec un
+backoff exponentiel ; un dernier flush est fait à l_arrêt.
+
+Une erreur définitive (droits retirés, plage invalide…) met le lot de côté dans le spool
+(colonne `erreur`) et appelle `sur_erreur_definitive(nb_lignes, erreur)`. Les lignes mises
+de côté sont comptées par `en_erreur()` et remises en file au démarrage suivant
+(`remettre_en_file`), une fois le problème corrigé.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import gspread
+
+from metrics import DUREE_ETAPE, ERREURS_SHEETS
+
+logger = logging.getLogger(__name__)
+
+CODES_HTTP_TRANSITOIRES = {429, 500, 502, 503, 504}
+
+
+def est_erreur_transitoire(e: Exception) -> bool:
+    if isinstance(e, gspread.exceptions.APIError):
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        return status in CODES_HTTP_TRANSITOIRES
+    # Coupures réseau, timeouts, etc.
+    return isinstance(e, (ConnectionError, TimeoutError, OSError))
+
+
+class SheetsBatchWriter:
+    def __init__(self, sheet, spool_path: str, taille_lot: int = 50, intervalle_s: float = 5.0,
+                 backoff_initial_s: float = 1.0, backoff_max_s: float = 120.0,
+                 reclamation_expiration_s: float = 300.0, sur_erreur_definitive=None):
+        self.sheet = sheet
+        self.sur_erreur_definitive = sur_erreur_definitive
+        self.taille_lot = taille_lot
+        self.intervalle_s = intervalle_s
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        # Un lot réclamé par un process qui a crashé redevient disponible après ce délai
+        self.reclamation_expiration_s = reclamation_expiration_s
+
+        dossier = os.path.dirname(spool_path)
+        if dossier:
+            os.makedirs(dossier, exist_ok=True)
+        self._conn = sqlite3.connect(spool_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " ligne TEXT NOT NULL,"
+            " cree_le REAL NOT NULL,"
+            " reclame_par TEXT,"
+            " reclame_le REAL,"
+            " erreur TEXT)"
+        )
+        self._lock = threading.Lock()
+        self._evenement = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._tache = None
+        self._arret = False
+
+    # --- Spool local -------------------------------------------------------
+
+    def _inserer(self, lignes: list) -> int:
+        maintenant = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO spool (ligne, cree_le) VALUES (?, ?)",
+                    [(json.dumps(ligne, ensure_ascii=False), maintenant) for ligne in lignes],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.execute("SELECT COUNT(*) FROM spool WHERE erreur IS NULL").fetchone()[0]
+
+    def _reclamer_lot(self):
+        jeton = uuid.uuid4().hex
+        maintenant = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, ligne FROM spool WHERE erreur IS NULL"
+                    " AND (reclame_le IS NULL OR reclame_le < ?) ORDER BY id LIMIT ?",
+                    (maintenant - self.reclamation_expiration_s, self.taille_lot),
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE spool SET reclame_par = ?, reclame_le = ? WHERE id = ?",
+                        [(jeton, maintenant, row_id) for row_id, _ in rows],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return jeton, [row_id for row_id, _ in rows], [json.loads(ligne) for _, ligne in rows]
+
+    def _prolonger(self, jeton: str, ids: list) -> bool:
+        """Rafraîchit la réclamation avant un nouvel essai ; False si le lot a été repris ailleurs."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                modifiees = sum(
+                    self._conn.execute(
+                        "UPDATE spool SET reclame_le = ? WHERE id = ? AND reclame_par = ?",
+                        (time.time(), row_id, jeton),
+                    ).rowcount
+                    for row_id in ids
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return modifiees == len(ids)
+
+    def _supprimer(self, ids: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+
+    def _liberer(self, ids: list, erreur: str | None = None):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE spool SET reclame_par = NULL, reclame_le = NULL, erreur = ? WHERE id = ?",
+                [(erreur, i) for i in ids],
+            )
+
+    def en_attente(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool WHERE erreur IS NULL").fetchone()[0]
+
+    def en_erreur(self) -> int:
+        """Lignes mises de côté après une erreur définitive."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool WHERE erreur IS NOT NULL").fetchone()[0]
+
+    def remettre_en_file(self) -> int:
+        """Remet les lignes mises de côté dans la file d_envoi ; retourne leur nombre."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE spool SET erreur = NULL, reclame_par = NULL, reclame_le = NULL WHERE erreur IS NOT NULL"
+            ).rowcount
+
+    # --- API publique --------------------------------------------------------
+
+    async def ajouter(self, ligne: list):
+        await self.ajouter_lignes([ligne])
+
+    async def ajouter_lignes(self, lignes: list):
+        """Pose les lignes dans le spool (durable) ; le flush vers Sheets se fait en tâche de fond."""
+        if not lignes:
+            return
+        nb_en_attente = await asyncio.to_thread(self._inserer, lignes)
+        if nb_en_attente >= self.taille_lot:
+            self._evenement.set()
+
+    def definir_sheet(self, sheet):
+        """Feuille disponible (initialisation différée) : ce qui attendait dans le spool part."""
+        self.sheet = sheet
+        self._evenement.set()
+
+    def demander_flush(self):
+        """Déclenche un flush sans attendre l_intervalle (ex. fin d_un album)."""
+        self._evenement.set()
+
+    async def demarrer(self):
+        if self._tache is None:
+            self._arret = False
+            self._stop.clear()
+            remises = await asyncio.to_thread(self.remettre_en_file)
+            if remises:
+                logger.warning(f"SheetsBatchWriter: {remises} ligne(s) mises de côté après une erreur remises en file.")
+            self._tache = asyncio.create_task(self._boucle(), name="sheets-writer")
+            logger.info(f"SheetsBatchWriter démarré ({self.en_attente()} lignes en attente dans le spool).")
+
+    async def arreter(self):
+        self._arret = True
+        self._stop.set()
+        self._evenement.set()
+        if self._tache is not None:
+            await self._tache
+            self._tache = None
+        # Flush final : ce qui ne part pas reste dans le spool pour le prochain démarrage
+        try:
+            await self.vider(retenter=False)
+        except Exception as e:
+            logger.error(f"SheetsBatchWriter: flush final incomplet, lignes conservées dans le spool: {e}")
+        with self._lock:
+            self._conn.close()
+
+    async def vider(self, retenter: bool = True):
+        """Envoie tout le spool par lots de `taille_lot`."""
+        if self.sheet is None:
+            return
+        while True:
+            jeton, ids, lignes = await asyncio.to_thread(self._reclamer_lot)
+            if not ids:
+                return
+            ok = await self._envoyer_lot(jeton, ids, lignes, retenter)
+            if not ok:
+                return
+
+    # --- Interne ----------------------------------------------------------------
+
+    async def _envoyer_lot(self, jeton: str, ids: list, lignes: list, retenter: bool) -> bool:
+        delai = self.backoff_initial_s
+        while True:
+            try:
+                with DUREE_ETAPE.chronometrer(etape="sheets_append_rows"):
+                    await asyncio.to_thread(self.sheet.append_rows, lignes)
+                await asyncio.to_thread(self._supprimer, ids)
+                logger.info(f"SheetsBatchWriter: {len(lignes)} lignes écrites dans Google Sheets.")
+                return True
+            except Exception as e:
+                transitoire = est_erreur_transitoire(e)
+                ERREURS_SHEETS.inc(type="transitoire" if transitoire else "definitive")
+                if not transitoire:
+                    logger.error(f"SheetsBatchWriter: erreur non transitoire, {len(ids)} lignes mises de côté dans le spool: {e}")
+                    logger.error(traceback.format_exc())
+                    await asyncio.to_thread(self._liberer, ids, str(e))
+                    if self.sur_erreur_definitive is not None:
+                        try:
+                            self.sur_erreur_definitive(len(ids), e)
+                        except Exception as e_rappel:
+                            logger.error(f"SheetsBatchWriter: sur_erreur_definitive a échoué: {e_rappel}")
+                    return True
+                if not retenter or self._arret:
+                    logger.warning(f"SheetsBatchWriter: erreur transitoire ({e}), lot remis dans le spool.")
+                    await asyncio.to_thread(self._liberer, ids)
+                    return False
+                attente = min(delai, self.backoff_max_s) * (0.5 + random.random() / 2)
+                logger.warning(f"SheetsBatchWriter: erreur transitoire ({e}), nouvel essai dans {attente:.1f}s.")
+                try:
+                    # Attente interrompue si l_arrêt est demandé pendant le backoff
+                    await asyncio.wait_for(self._stop.wait(), timeout=attente)
+                except asyncio.TimeoutError:
+                    pass
+                delai *= 2
+                # Les essais cumulés peuvent dépasser reclamation_expiration_s : sans ce rafraîchissement,
+                # un autre process reprendrait le lot et l_ajouterait une deuxième fois dans la feuille
+                if not await asyncio.to_thread(self._prolonger, jeton, ids):
+                    logger.warning(f"SheetsBatchWriter: lot de {len(ids)} lignes repris par un autre process, abandon de l_envoi.")
+                    return True
+
+    async def _boucle(self):
+        while not self._arret:
+            try:
+                await asyncio.wait_for(self._evenement.wait(), timeout=self.intervalle_s)
+            except asyncio.TimeoutError:
+                pass
+            self._evenement.clear()
+            if self._arret:
+                break
+            try:
+                await self.vider()
+            except Exception as e:
+                logger.error(f"SheetsBatchWriter: erreur inattendue dans la boucle de flush: {e}")
+                logger.error(traceback.format_exc())
@@ -0,0 +1,222 @@
+"""Envoi des messages Telegram en tâche de fond, avec limitation de débit par chat.
+
+Les handlers et les workers ne font que poser des messages (méthodes non bloquantes) ;
+une seule tâche les envoie :
+- seau à jetons par chat (Telegram limite à ~20 messages / minute dans un groupe) ;
+- RetryAfter : le chat est mis en pause le temps demandé, puis le message est renvoyé ;
+- confirmations regroupées : les lignes arrivées pendant `fenetre_s` partent en un seul
+  message récapitulatif (une ligne par compte) ;
+- erreurs dédupliquées : le même avis (aux nombres près) n_est envoyé qu_une fois par
+  `dedup_erreurs_s`, avec le nombre de répétitions masquées au prochain envoi.
+
+Les ids de chat sont normalisés (-100123 et "-100123" sont le même chat). La limite vaut
+pour une instance : chaque process qui envoie a la sienne (voir main.py).
+"""
+import asyncio
+import collections
+import contextlib
+import datetime
+import logging
+import re
+import time
+
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+from metrics import DUREE_ETAPE, REGISTRE
+
+logger = logging.getLogger(__name__)
+
+TAILLE_MAX_MESSAGE = 4096
+MAX_TENTATIVES_RESEAU = 3
+
+MESSAGES_ENVOYES = REGISTRE.compteur("bot_telegram_messages_total", "Messages Telegram envoyés", labels=("type",))
+RETRY_AFTER = REGISTRE.compteur("bot_telegram_retry_after_total", "Réponses RetryAfter (flood control) de Telegram")
+ERREURS_MASQUEES = REGISTRE.compteur("bot_telegram_erreurs_masquees_total", "Avis d_erreur non envoyés car déjà signalés")
+
+
+class _SeauJetons:
+    def __init__(self, capacite: float, debit_par_s: float):
+        self.capacite = capacite
+        self.debit_par_s = debit_par_s
+        self.jetons = capacite
+        self.maj = time.monotonic()
+
+    def attente(self, maintenant: float) -> float:
+        """0 si un jeton est disponible (et le consomme), sinon le délai avant le prochain."""
+        self.jetons = min(self.capacite, self.jetons + (maintenant - self.maj) * self.debit_par_s)
+        self.maj = maintenant
+        if self.jetons >= 1:
+            self.jetons -= 1
+            return 0.0
+        return (1 - self.jetons) / self.debit_par_s
+
+
+def decouper_message(lignes: list, entete: str) -> list:
+    """Messages de moins de TAILLE_MAX_MESSAGE caractères, sans couper une ligne."""
+    messages, courant = [], entete
+    for ligne in lignes:
+        if len(courant) + 1 + len(ligne) > TAILLE_MAX_MESSAGE and courant != entete:
+            messages.append(courant)
+            courant = entete
+        courant = f"{courant}\n{ligne}"[:TAILLE_MAX_MESSAGE]
+    messages.append(courant)
+    return messages
+
+
+def normaliser_chat_id(chat_id):
+    """Id numérique en int (TELEGRAM_GROUP_ID arrive en str) ; "@canal" reste tel quel."""
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+
+class EnvoyeurTelegram:
+    def __init__(self, bot, fenetre_s: float = 3.0, messages_par_minute: float = 20.0, rafale: int = 3,
+                 dedup_erreurs_s: float = 300.0, max_lignes_digest: int = 50):
+        self.bot = bot
+        self.fenetre_s = fenetre_s
+        self.messages_par_minute = messages_par_minute
+        self.rafale = rafale
+        self.dedup_erreurs_s = dedup_erreurs_s
+        self.max_lignes_digest = max_lignes_digest
+        self._digests = {}  # chat_id -> (échéance, [lignes])
+        self._sortants = collections.defaultdict(collections.deque)  # chat_id -> (texte, kwargs, type)
+        self._seaux = {}
+        self._pauses = {}  # chat_id -> fin du RetryAfter
+        self._erreurs_vues = {}  # clé -> (dernier envoi, répétitions masquées)
+        self._evenement = asyncio.Event()
+        self._tache = None
+        self._arret = False
+
+    # --- API publique (non bloquante) --------------------------------------------
+
+    def confirmer(self, chat_id, ligne: str):
+        """Ajoute une ligne au prochain message récapitulatif du chat."""
+        chat_id = normaliser_chat_id(chat_id)
+        echeance, lignes = self._digests.get(chat_id) or (time.monotonic() + self.fenetre_s, [])
+        lignes.append(ligne)
+        if len(lignes) >= self.max_lignes_digest:
+            echeance = 0.0
+        self._digests[chat_id] = (echeance, lignes)
+        self._evenement.set()
+
+    def envoyer(self, chat_id, texte: str, **kwargs):
+        self._poser(chat_id, texte, kwargs, "direct")
+
+    def signaler_erreur(self, chat_id, texte: str):
+        chat_id = normaliser_chat_id(chat_id)
+        # Même avis aux nombres près (ids, compteurs) = même erreur
+        cle = (chat_id, re.sub(r"\d+", "#", texte))
+        maintenant = time.monotonic()
+        dernier, masquees = self._erreurs_vues.get(cle, (None, 0))
+        if dernier is not None and maintenant - dernier < self.dedup_erreurs_s:
+            self._erreurs_vues[cle] = (dernier, masquees + 1)
+            ERREURS_MASQUEES.inc()
+            logger.info(f"Avis d_erreur déjà envoyé récemment, masqué: {texte}")
+            return
+        if len(self._erreurs_vues) > 1000:
+            self._erreurs_vues = {
+                c: v for c, v in self._erreurs_vues.items() if maintenant - v[0] < self.dedup_erreurs_s
+            }
+        if masquees:
+            texte = f"{texte}\n(répété {masquees} fois depuis le dernier avis)"
+        self._erreurs_vues[cle] = (maintenant, 0)
+        self._poser(chat_id, texte, {}, "erreur")
+
+    async def demarrer(self):
+        if self._tache is None:
+            self._arret = False
+            self._tache = asyncio.create_task(self._boucle(), name="telegram-sender")
+
+    async def arreter(self, delai_max_s: float = 10.0):
+        """Vide les récapitulatifs et la file d_envoi (dans la limite de `delai_max_s`)."""
+        self._arret = True
+        self._evenement.set()
+        if self._tache is not None:
+            try:
+                await asyncio.wait_for(self._tache, timeout=delai_max_s)
+            except asyncio.TimeoutError:
+                restants = sum(len(file) for file in self._sortants.values())
+                logger.warning(f"EnvoyeurTelegram: arrêt avec {restants} message(s) non envoyé(s).")
+            self._tache = None
+
+    # --- Interne --------------------------------------------------------------------
+
+    def _poser(self, chat_id, texte: str, kwargs: dict, type_message: str):
+        chat_id = normaliser_chat_id(chat_id)
+        self._sortants[chat_id].append((texte[:TAILLE_MAX_MESSAGE], kwargs, type_message))
+        self._evenement.set()
+
+    def _vider_digests(self, maintenant: float):
+        for chat_id, (echeance, lignes) in list(self._digests.items()):
+            if echeance > maintenant and not self._arret:
+                continue
+            del self._digests[chat_id]
+            entete = f"🤖 {datetime.datetime.now().strftime('%d/%m/%Y')}"
+            if len(lignes) == 1:
+                messages = [f"{entete} - {lignes[0]}"]
+            else:
+                messages = decouper_message([f"• {ligne}" for ligne in lignes], f"{entete} - {len(lignes)} captures")
+            for texte in messages:
+                self._sortants[chat_id].append((texte, {}, "digest"))
+
+    def _seau(self, chat_id) -> _SeauJetons:
+        if chat_id not in self._seaux:
+            self._seaux[chat_id] = _SeauJetons(self.rafale, self.messages_par_minute / 60)
+        return self._seaux[chat_id]
+
+    async def _envoyer(self, chat_id, texte: str, kwargs: dict, type_message: str) -> float | None:
+        """None si traité (envoyé ou abandonné), sinon le délai avant de réessayer."""
+        for tentative in range(1, MAX_TENTATIVES_RESEAU + 1):
+            try:
+                with DUREE_ETAPE.chronometrer(etape="send_message"):
+                    await self.bot.send_message(chat_id, text=texte, **kwargs)
+                MESSAGES_ENVOYES.inc(type=type_message)
+                return None
+            except RetryAfter as e:
+                RETRY_AFTER.inc()
+                attente = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                logger.warning(f"EnvoyeurTelegram: RetryAfter sur le chat {chat_id}, pause de {attente:.0f}s.")
+                return attente
+            except (TimedOut, NetworkError) as e:
+                if tentative == MAX_TENTATIVES_RESEAU:
+                    logger.error(f"Envoi du message Telegram impossible après {tentative} tentatives: {e}")
+                    return None
+                await asyncio.sleep(tentative)
+            except Exception as e:
+                logger.error(f"Envoi du message Telegram impossible: {e}")
+                return None
+
+    async def _boucle(self):
+        while True:
+            # Effacé avant de traiter : un message posé pendant un envoi réveille la boucle
+            self._evenement.clear()
+            maintenant = time.monotonic()
+            self._vider_digests(maintenant)
+            prochain = None
+            for chat_id, file in list(self._sortants.items()):
+                if not file:
+                    del self._sortants[chat_id]
+                    continue
+                pause = self._pauses.get(chat_id, 0.0) - maintenant
+                attente = pause if pause > 0 else self._seau(chat_id).attente(maintenant)
+                if attente <= 0:
+                    texte, kwargs, type_message = file[0]
+                    attente = await self._envoyer(chat_id, texte, kwargs, type_message)
+                    if attente is None:
+                        file.popleft()
+                        attente = 0.0
+                    else:
+                        self._pauses[chat_id] = time.monotonic() + attente
+                prochain = attente if prochain is None else min(prochain, attente)
+            for echeance, _ in self._digests.values():
+                delai = max(0.0, echeance - time.monotonic())
+                prochain = delai if prochain is None else min(prochain, delai)
+
+            if self._arret and not self._digests and not any(self._sortants.values()):
+                return
+            if prochain == 0.0:
+                continue
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._evenement.wait(), timeout=prochain)